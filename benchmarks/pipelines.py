@@ -0,0 +1,347 @@
+"""Benchmark: every model pipeline end to end, without Telegram.
+
+Drives each task's ``process_image`` on a synthetic (or supplied) corpus at
+several resolutions and concurrency levels, and reports throughput, latency
+percentiles, peak RSS and CPU time as JSON so runs can be compared.
+
+Run from the repository root:
+    python -m benchmarks.pipelines --stub --sizes 640,1920 --concurrency 1,4
+    python -m benchmarks.pipelines --tasks object_detection --output base.json
+    python -m benchmarks.pipelines --tasks object_detection --compare base.json
+    python -m benchmarks.pipelines --tasks emotion_recognition --detector-backends opencv,ssd,yunet,retinaface
+
+``--stub`` (all tasks) or ``--stub object_detection,...`` swaps the named
+models for the stand-ins in ``benchmarks/stubs.py``, so the harness also runs
+where the real checkpoints are not available.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+import yaml
+from benchmarks import stubs
+from bot.scheduler import TASKS
+from models.registry import build_registry, current_rss_mb
+
+TEXT_LINES = (
+    "SnapSense benchmark corpus",
+    "The quick brown fox jumps over the lazy dog",
+    "0123456789 ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+)
+
+
+def synthetic_image(longest_side: int, seed: int) -> np.ndarray:
+    """A 4:3 photo-like image with shapes for the detectors and text for OCR"""
+    width, height = longest_side, longest_side * 3 // 4
+    rng = np.random.default_rng(seed)
+
+    # Smooth background gradient plus noise keeps JPEG/PNG encoding realistic
+    gradient = np.linspace(60, 200, width, dtype=np.float32)[None, :, None]
+    image = np.repeat(np.repeat(gradient, height, axis=0), 3, axis=2)
+    image += rng.normal(0, 8, image.shape).astype(np.float32)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 20, width // 6)),) * 2
+        cv2.ellipse(image, center, axes, 0, 0, 360, color, -1)
+
+    scale = longest_side / 1000
+    for i, line in enumerate(TEXT_LINES * 3):
+        y = int((i + 1) * height / (len(TEXT_LINES) * 3 + 1))
+        cv2.putText(
+            image,
+            line,
+            (int(20 * scale), y),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            scale,
+            (0, 0, 0),
+            max(1, int(2 * scale)),
+        )
+    return image
+
+
+def load_corpus(corpus_dir: str, longest_side: int) -> List[np.ndarray]:
+    images = []
+    for path in sorted(Path(corpus_dir).iterdir()):
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        scale = longest_side / max(image.shape[:2])
+        images.append(
+            cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        )
+    if not images:
+        raise ValueError(f"No readable images in {corpus_dir}")
+    return images
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is the process high-water mark: KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+async def run_case(
+    task: str,
+    images: List[np.ndarray],
+    resources: Dict[str, Any],
+    concurrency: int,
+    requests: int,
+) -> Dict[str, Any]:
+    from bot.tasks import run_task
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=task)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await run_task(task, images[index % len(images)], resources, executor)
+            except Exception as e:
+                errors += 1
+                print(f"  {task} request {index} failed: {e}", file=sys.stderr)
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        # Warm-up request: first-call costs are not what we're measuring
+        await one(0)
+        latencies.clear()
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    finally:
+        executor.shutdown(wait=True)
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        "requests": requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(requests / wall, 3) if wall else 0.0,
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies_ms)), 2),
+            "p50": round(percentile(latencies_ms, 50), 2),
+            "p95": round(percentile(latencies_ms, 95), 2),
+            "p99": round(percentile(latencies_ms, 99), 2),
+            "max": round(max(latencies_ms), 2),
+        },
+        "cpu_seconds": round(cpu, 3),
+        "cpu_ms_per_request": round(cpu / requests * 1000, 2),
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run_benchmarks(args, config) -> Dict[str, Any]:
+    stubbed = set(TASKS if args.stub == "all" else args.stub or ()) & set(args.tasks)
+    registry = build_registry(config)
+    stubs.install(registry, config, stubbed)
+    resources = {"config": config, "model_registry": registry}
+
+    results = []
+    with stubs.patched_engines(stubbed):
+        for task, variant in task_variants(args):
+            if variant:
+                config["models"][task][VARIANT_KEYS[task]] = variant
+
+            load_seconds = None
+            if task in registry:
+                started = time.perf_counter()
+                await registry.load(task)
+                load_seconds = round(time.perf_counter() - started, 3)
+
+            for size in args.sizes:
+                if args.corpus:
+                    images = load_corpus(args.corpus, size)
+                else:
+                    images = [
+                        synthetic_image(size, seed) for seed in range(args.images)
+                    ]
+
+                for concurrency in args.concurrency:
+                    print(
+                        f"{label(task, variant)} @ {size}px, "
+                        f"concurrency {concurrency}...",
+                        file=sys.stderr,
+                    )
+                    case = await run_case(
+                        task, images, resources, concurrency, args.requests
+                    )
+                    results.append(
+                        {
+                            "task": task,
+                            "variant": variant,
+                            "stub": task in stubbed,
+                            "size": size,
+                            "concurrency": concurrency,
+                            "model_load_seconds": load_seconds,
+                            **case,
+                        }
+                    )
+
+            if task in registry:
+                await registry.unload(task)
+
+    return {"meta": run_metadata(args), "results": results}
+
+
+# Config key a task's variants replace, e.g. one run per face detector backend
+VARIANT_KEYS = {"emotion_recognition": "emotion_detector_backend"}
+
+
+def task_variants(args) -> List[Tuple[str, Optional[str]]]:
+    variants = []
+    for task in args.tasks:
+        if task == "emotion_recognition" and args.detector_backends:
+            variants.extend((task, backend) for backend in args.detector_backends)
+        else:
+            variants.append((task, None))
+    return variants
+
+
+def label(task: str, variant: Optional[str] = None) -> str:
+    return f"{task}[{variant}]" if variant else task
+
+
+def run_metadata(args) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {
+            key: value for key, value in vars(args).items() if key not in ("compare",)
+        },
+    }
+
+
+def print_table(report: Dict[str, Any], baseline: Dict[str, Any] = None):
+    previous = {}
+    if baseline:
+        previous = {
+            (r["task"], r.get("variant"), r["size"], r["concurrency"]): r
+            for r in baseline["results"]
+        }
+
+    print(
+        f"{'task':<28} {'size':>5} {'conc':>4} {'rps':>8} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'cpu ms/req':>10} {'peak MB':>8}"
+    )
+    for r in report["results"]:
+        latency = r["latency_ms"]
+        line = (
+            f"{label(r['task'], r.get('variant')):<28} {r['size']:>5} {r['concurrency']:>4} "
+            f"{r['throughput_rps']:>8.2f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} "
+            f"{latency['p99']:>9.1f} {r['cpu_ms_per_request']:>10.1f} {r['peak_rss_mb']:>8.0f}"
+        )
+        if old := previous.get(
+            (r["task"], r.get("variant"), r["size"], r["concurrency"])
+        ):
+            line += (
+                f"  (rps {_delta(r['throughput_rps'], old['throughput_rps'])}, "
+                f"p95 {_delta(latency['p95'], old['latency_ms']['p95'])})"
+            )
+        print(line)
+
+
+def _delta(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=parse_list, default=list(TASKS))
+    parser.add_argument(
+        "--sizes", type=lambda v: parse_list(v, int), default=[640, 1280, 2560]
+    )
+    parser.add_argument(
+        "--concurrency", type=lambda v: parse_list(v, int), default=[1, 4]
+    )
+    parser.add_argument("--requests", type=int, default=16, help="per case")
+    parser.add_argument("--images", type=int, default=4, help="synthetic images")
+    parser.add_argument("--corpus", help="directory of images to use instead")
+    parser.add_argument(
+        "--stub",
+        nargs="?",
+        const="all",
+        type=lambda v: v if v == "all" else parse_list(v),
+        help="use stand-in models for all tasks, or a comma-separated subset",
+    )
+    parser.add_argument(
+        "--detector-backends",
+        type=parse_list,
+        help="run emotion_recognition once per face detector, e.g. opencv,ssd,yunet",
+    )
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="JSON report to compare against")
+    parser.add_argument(
+        "--keep-caches",
+        action="store_true",
+        help="keep the SAM embedding cache on (repeat images would hit it)",
+    )
+    args = parser.parse_args()
+
+    if unknown := set(args.tasks) - set(TASKS):
+        parser.error(f"unknown tasks: {', '.join(sorted(unknown))}")
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    if not args.keep_caches:
+        config["models"]["image_segmentation"]["embedding_cache_size"] = 0
+
+    report = asyncio.run(run_benchmarks(args, config))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Lightweight stand-ins for the models, so pipelines can be benchmarked without
+the multi-GB checkpoints (e.g. on CI).
+
+Each stand-in replaces only the network call and returns plausible output of
+the right shape, so downscaling, batching, post-processing, compositing and
+encoding all still run the real code.
+"""
+
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterable
+from unittest import mock
+import cv2
+import numpy as np
+from benchmarks.segmentation_compositing import synthetic_masks
+from bot.scheduler import BATCHED_TASKS
+
+YOLO_NAMES = {0: "person", 1: "bicycle", 2: "car", 3: "dog", 4: "chair"}
+
+
+def _rng(image: np.ndarray) -> np.random.Generator:
+    # Same image size, same output: runs stay comparable
+    return np.random.default_rng(image.shape[0] * 7919 + image.shape[1])
+
+
+class StubYOLO:
+    """Callable like ``ultralytics.YOLO``, returning real ``Results`` objects"""
+
+    def __init__(self, boxes: int = 8):
+        self.boxes = boxes
+
+    def __call__(self, sources, **kwargs):
+        import torch
+        from ultralytics.engine.results import Results
+
+        results = []
+        for source in sources:
+            height, width = source.shape[:2]
+            rng = _rng(source)
+            x1 = rng.uniform(0, width * 0.8, self.boxes)
+            y1 = rng.uniform(0, height * 0.8, self.boxes)
+            x2 = np.minimum(x1 + rng.uniform(16, width * 0.2, self.boxes), width)
+            y2 = np.minimum(y1 + rng.uniform(16, height * 0.2, self.boxes), height)
+            conf = rng.uniform(0.3, 1.0, self.boxes)
+            cls = rng.integers(0, len(YOLO_NAMES), self.boxes)
+            boxes = torch.tensor(np.stack([x1, y1, x2, y2, conf, cls], axis=1))
+
+            result = Results(source, path="", names=YOLO_NAMES, boxes=boxes)
+            result.speed = {"preprocess": 0.0, "inference": 0.0, "postprocess": 0.0}
+            results.append(result)
+        return results
+
+
+def object_detection_model(config: Dict[str, Any]) -> Dict[str, Any]:
+    from functools import partial
+    from bot.strings import Strings
+    from models.batching import MicroBatcher
+    from models.object_detection import object_detection
+
+    model_data = {
+        "model": StubYOLO(),
+        "device": "cpu",
+        "half": False,
+        "backend": "stub",
+        "model_name": Strings.MODEL_NAMES["object_detection"],
+    }
+    batching = config.get("batching", {})
+    model_data["batcher"] = MicroBatcher(
+        partial(object_detection._predict_batch, model_data, config),
+        max_batch_size=batching.get("max_batch_size", 16),
+        max_wait_ms=batching.get("max_wait_ms", 20),
+        name="object_detection",
+    )
+    return model_data
+
+
+class StubNudeDetector:
+    CLASSES = ("FACE_FEMALE", "FEMALE_BREAST_EXPOSED", "ARMPITS_EXPOSED")
+
+    def detect(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        rng = _rng(image)
+        detections = []
+        for name in self.CLASSES:
+            w, h = int(width * rng.uniform(0.05, 0.2)), int(
+                height * rng.uniform(0.05, 0.2)
+            )
+            x, y = int(rng.uniform(0, width - w)), int(rng.uniform(0, height - h))
+            detections.append({"class": name, "score": 0.9, "box": [x, y, w, h]})
+        return detections
+
+
+class StubMaskGenerator:
+    def __init__(self, masks: int = 48):
+        self.masks = masks
+
+    def generate(self, image_rgb: np.ndarray):
+        height, width = image_rgb.shape[:2]
+        return synthetic_masks(width, height, self.masks)
+
+
+def nudity_detection_model(config: Dict[str, Any]) -> Dict[str, Any]:
+    from functools import partial
+    from models.batching import MicroBatcher
+    from models.nudity_detection import nudity_detection
+
+    # No detect_batch: the stand-in is called once per image, like older NudeNet
+    model_data = {"detector": StubNudeDetector(), "batched": False}
+    batching = config.get("batching", {})
+    model_data["batcher"] = MicroBatcher(
+        partial(nudity_detection._detect_batch, model_data),
+        max_batch_size=batching.get("max_batch_size", 10),
+        max_wait_ms=batching.get("max_wait_ms", 20),
+        name="nudity_detection",
+    )
+    return model_data
+
+
+def image_segmentation_model(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "generator": StubMaskGenerator(),
+        "lock": threading.Lock(),
+    }
+
+
+class StubRembgSession:
+    """Answers rembg's ``session.predict`` with a centered elliptical mask"""
+
+    def predict(self, img, *args, **kwargs):
+        from PIL import Image
+
+        width, height = img.size
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(
+            mask,
+            (width // 2, height // 2),
+            (width // 3, height // 3),
+            0,
+            0,
+            360,
+            255,
+            -1,
+        )
+        return [Image.fromarray(mask)]
+
+
+def background_removal_model(config: Dict[str, Any]):
+    from models.background_removal.background_removal import SessionPool
+
+    sessions = [StubRembgSession() for _ in range(max(1, config.get("pool_size", 1)))]
+    return SessionPool(sessions, "stub")
+
+
+def _stub_ocr(image, lang=None, config=None) -> str:
+    return "Lorem ipsum dolor sit amet\n" * max(1, image.shape[0] // 40)
+
+
+def _stub_extract_faces(img_path, **kwargs):
+    height, width = img_path.shape[:2]
+    x, y, w, h = width // 4, height // 4, width // 4, height // 4
+    face = img_path[y : y + h, x : x + w, ::-1].astype(np.float32) / 255
+    return [
+        {
+            "face": face,
+            "facial_area": {
+                "x": x,
+                "y": y,
+                "w": w,
+                "h": h,
+                "left_eye": None,
+                "right_eye": None,
+            },
+            "confidence": 0.9,
+        }
+    ]
+
+
+class StubEmotionClient:
+    """Answers like DeepFace's Emotion client, with the same input checks.
+
+    Faces are stacked the way the client does it, so anything other than
+    (224, 224, 3) crops fails here as it would in the real preprocessing.
+    """
+
+    def predict(self, faces) -> np.ndarray:
+        batch = np.array(faces)
+        if batch.ndim == 3:
+            batch = batch[np.newaxis]
+        if batch.ndim != 4 or batch.shape[1:] != (224, 224, 3):
+            raise ValueError(f"Expected (n, 224, 224, 3) faces, got {batch.shape}")
+        scores = np.full((len(batch), 7), 0.02, dtype=np.float32)
+        scores[:, 3] = 0.88
+        # A single face gives one row, not a batch of one
+        return scores[0] if len(batch) == 1 else scores
+
+
+def emotion_recognition_model(config: Dict[str, Any]) -> Dict[str, Any]:
+    from functools import partial
+    from models.batching import MicroBatcher
+    from models.emotion_recognition import emotion_recognition
+
+    model_data = {
+        "client": StubEmotionClient(),
+        "detector_backend": config["emotion_detector_backend"],
+    }
+    batching = config.get("batching", {})
+    model_data["batcher"] = MicroBatcher(
+        partial(emotion_recognition._classify_batch, model_data),
+        max_batch_size=batching.get("max_batch_size", 10),
+        max_wait_ms=batching.get("max_wait_ms", 20),
+        name="emotion_recognition",
+    )
+    return model_data
+
+
+REGISTRY_STUBS = {
+    "object_detection": object_detection_model,
+    "nudity_detection": nudity_detection_model,
+    "image_segmentation": image_segmentation_model,
+    "background_removal": background_removal_model,
+    "emotion_recognition": emotion_recognition_model,
+}
+
+
+def install(registry, config: Dict[str, Any], tasks: Iterable[str]):
+    """Re-register ``tasks`` in the registry with stand-in loaders"""
+    models_config = config["models"]
+    for task in tasks:
+        if task in REGISTRY_STUBS:
+            loader = REGISTRY_STUBS[task]
+            registry.register(
+                task,
+                lambda loader=loader, task=task: loader(models_config[task]),
+                unloader=(
+                    (lambda model_data: model_data["batcher"].close())
+                    if task in BATCHED_TASKS
+                    else None
+                ),
+            )
+
+
+@contextmanager
+def patched_engines(tasks: Iterable[str]):
+    """Swap the module-level engines (Tesseract, DeepFace face detection) for stand-ins"""
+    tasks = set(tasks)
+    with ExitStack() as stack:
+        if "text_extraction" in tasks:
+            from models.text_extraction import text_extraction
+
+            stack.enter_context(
+                mock.patch.object(
+                    text_extraction.pytesseract, "image_to_string", _stub_ocr
+                )
+            )
+        if "emotion_recognition" in tasks:
+            from models.emotion_recognition import emotion_recognition
+
+            stack.enter_context(
+                mock.patch.object(
+                    emotion_recognition.DeepFace, "extract_faces", _stub_extract_faces
+                )
+            )
+        yield
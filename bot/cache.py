@@ -0,0 +1,222 @@
+import os
+import io
+import json
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Result fields worth keeping; everything else is rebuilt or irrelevant on a hit
+CACHED_FIELDS = (
+    "model_name",
+    "detection_summary",
+    "speed_summary",
+    "text",
+    "emotions",
+    "faces_detected",
+)
+
+
+def content_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """LRU/TTL cache of task results keyed by image, task and task config.
+
+    Entries live in memory and, when ``disk_dir`` is set, in one pickle file
+    per entry so they survive restarts.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        cache_config = config.get("cache", {})
+        self.enabled = cache_config.get("enabled", True)
+        self.max_entries = cache_config.get("max_entries", 512)
+        self.max_bytes = cache_config.get("max_bytes", 256 * 1024 * 1024)
+        self.ttl = cache_config.get("ttl_seconds", 24 * 60 * 60)
+        self.disk_dir = cache_config.get("disk_dir")
+        self.disk_max_bytes = cache_config.get("disk_max_bytes", 1024 * 1024 * 1024)
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled and self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(source_id: str, task: str, task_config: Dict[str, Any]) -> str:
+        config_hash = hashlib.sha256(
+            json.dumps(task_config, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+        return hashlib.sha256(f"{task}:{config_hash}:{source_id}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._to_result(entry)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        if not self.enabled:
+            return
+
+        entry = {
+            "fields": {k: result[k] for k in CACHED_FIELDS if k in result},
+            "image": None,
+            "image_name": None,
+            # A result served from another key may already have been uploaded
+            "file_id": result.get("file_id"),
+            "created": time.time(),
+        }
+        if image_buffer := result.get("image_buffer"):
+            entry["image"] = image_buffer.getvalue()
+            entry["image_name"] = getattr(image_buffer, "name", "result.jpg")
+
+        with self._lock:
+            self._store(key, entry)
+        self._save(key, entry)
+
+    def put_all(self, keys: List[str], result: Dict[str, Any]):
+        for key in keys:
+            self.put(key, result)
+
+    def set_file_ids(self, keys: List[str], file_id: str):
+        for key in keys:
+            self.set_file_id(key, file_id)
+
+    def set_file_id(self, key: str, file_id: str):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["file_id"] = file_id
+        self._save(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return bool(self.ttl) and time.time() - entry["created"] > self.ttl
+
+    def _store(self, key: str, entry: Dict[str, Any]):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self._bytes += self._entry_size(entry)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= self._entry_size(entry)
+
+    @staticmethod
+    def _entry_size(entry: Dict[str, Any]) -> int:
+        return len(entry["image"] or b"") + len(str(entry["fields"]))
+
+    @staticmethod
+    def _to_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+        result = dict(entry["fields"])
+        if entry["image"] is not None:
+            image_buffer = io.BytesIO(entry["image"])
+            image_buffer.name = entry["image_name"]
+            result["image_buffer"] = image_buffer
+        if entry["file_id"]:
+            result["file_id"] = entry["file_id"]
+        return result
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pickle")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove_file(path)
+            return None
+
+        if self._expired(entry):
+            self._remove_file(path)
+            return None
+        return entry
+
+    def _save(self, key: str, entry: Dict[str, Any]):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+
+    def _trim_disk(self):
+        files = []
+        total = 0
+        with os.scandir(self.disk_dir) as it:
+            for item in it:
+                if item.name.endswith(".pickle"):
+                    stat = item.stat()
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+                    total += stat.st_size
+
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,106 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from bot.cache import content_key
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdStore:
+    """Telegram file ids of everything the bot has uploaded, keyed by content hash.
+
+    Sending the same bytes again (a repeated result, a static asset) can then
+    reference the file id instead of uploading. Recent ids are kept in memory;
+    all of them persist in a small SQLite table so they survive restarts.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        store_config = config.get("file_ids", {})
+        self.enabled = store_config.get("enabled", True)
+        self.max_memory_entries = store_config.get("max_memory_entries", 10000)
+        self.path = store_config.get("path")
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "key TEXT PRIMARY KEY, file_id TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(data: bytes, kind: str = "photo") -> str:
+        # A photo's file id can't be sent as a document and vice versa
+        return f"{kind}:{content_key(data)}"
+
+    def get(self, data: bytes, kind: str = "photo") -> Optional[str]:
+        if not self.enabled:
+            return None
+
+        key = self.make_key(data, kind)
+        with self._lock:
+            file_id = self._memory.get(key)
+            if file_id is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT file_id FROM file_ids WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    file_id = row[0]
+                    self._remember(key, file_id)
+            elif file_id is not None:
+                self._memory.move_to_end(key)
+
+        if file_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return file_id
+
+    def put(self, data: bytes, file_id: str, kind: str = "photo"):
+        if not self.enabled or not file_id:
+            return
+
+        key = self.make_key(data, kind)
+        with self._lock:
+            self._remember(key, file_id)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO file_ids (key, file_id, created) "
+                        "VALUES (?, ?, ?)",
+                        (key, file_id, time.time()),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to record file id: {e}")
+
+    def discard(self, data: bytes, kind: str = "photo"):
+        """Forget a file id Telegram no longer accepts"""
+        if not self.enabled:
+            return
+
+        key = self.make_key(data, kind)
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+    def _remember(self, key: str, file_id: str):
+        self._memory[key] = file_id
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
@@ -1,5 +1,6 @@
-import os
+import time
 import asyncio
+from typing import Tuple
 from telegram import Update
 from telegram.ext import (
     CallbackQueryHandler,
@@ -8,14 +9,12 @@ from telegram.ext import (
     filters,
     CallbackContext,
 )
-from bot import keyboards, utils
+from bot import keyboards, metrics, utils
+from bot.cache import content_key
+from bot.scheduler import OWNER, SchedulerBusyError
 from bot.strings import Strings
-from models.object_detection import object_detection
-from models.nudity_detection import nudity_detection
-from models.text_extraction import text_extraction
-from models.background_removal import background_removal
-from models.emotion_recognition import emotion_recognition
-from models.image_segmentation import image_segmentation
+from bot.workspaces import workspace_dir
+from models import image_utils
 
 
 async def start_handler(update: Update, context: CallbackContext):
@@ -34,8 +33,13 @@ async def start_handler(update: Update, context: CallbackContext):
 async def button_handler(update: Update, context: CallbackContext):
     try:
         query = update.callback_query
-        await query.answer()
         task_id = query.data
+        combo_tasks = context.user_data.get("combo_tasks", [])
+
+        if task_id == Strings.COMBO_RUN_CALLBACK and not combo_tasks:
+            await query.answer(Strings.COMBO_EMPTY, show_alert=True)
+            return
+        await query.answer()
 
         if task_id in Strings.MENU_ITEMS:
             _, _, task_message = Strings.MENU_ITEMS[task_id]
@@ -46,6 +50,35 @@ async def button_handler(update: Update, context: CallbackContext):
             )
             context.user_data["prev_message"] = edited_msg.message_id
 
+        elif task_id == Strings.COMBO_ITEM[1]:
+            context.user_data["combo_tasks"] = []
+            edited_msg = await query.edit_message_text(
+                text=Strings.COMBO_SELECTION, reply_markup=keyboards.combo_menu([])
+            )
+            context.user_data["prev_message"] = edited_msg.message_id
+
+        elif task_id == Strings.COMBO_RUN_CALLBACK:
+            task_names = ", ".join(Strings.MENU_ITEMS[t][2] for t in combo_tasks)
+            context.user_data.update(
+                {"task": "combo", "task_message": Strings.COMBO_ITEM[2]}
+            )
+
+            edited_msg = await query.edit_message_text(
+                text=Strings.TASK_SELECTION.format(task_names)
+            )
+            context.user_data["prev_message"] = edited_msg.message_id
+
+        elif task_id.startswith(Strings.COMBO_TOGGLE_PREFIX):
+            toggled = task_id[len(Strings.COMBO_TOGGLE_PREFIX) :]
+            selected = set(combo_tasks) ^ {toggled}
+            # Keep the menu order so results always come back in the same sequence
+            combo_tasks = [t for t in Strings.MENU_ITEMS if t in selected]
+            context.user_data["combo_tasks"] = combo_tasks
+
+            await query.edit_message_reply_markup(
+                reply_markup=keyboards.combo_menu(combo_tasks)
+            )
+
     except Exception as e:
         utils.logger.error(f"Button handler error: {e}")
         await handle_error(update, context)
@@ -60,92 +93,470 @@ async def photo_handler(update: Update, context: CallbackContext):
             )
             return
 
-        await utils.delete_prev_messages(update, context)
-        ack_message = await update.message.reply_text(
-            Strings.PROCESSING, reply_to_message_id=update.message.message_id
+        config = context.bot_data["config"]
+        if utils.document_too_large(update.message, config):
+            await update.message.reply_text(
+                Strings.FILE_TOO_LARGE.format(config["app"].get("max_document_mb", 20)),
+                reply_to_message_id=update.message.message_id,
+            )
+            return
+
+        if update.message.media_group_id:
+            await collect_album(update, context)
+            return
+
+        metrics.REQUEST_ID.set(
+            f"{update.effective_chat.id}:{update.message.message_id}"
         )
-        context.user_data["prev_message"] = ack_message.message_id
+        OWNER.set(update.effective_user and update.effective_user.id)
+        tasks = context.user_data.get("combo_tasks", []) if task == "combo" else [task]
+        if not await within_rate_limit(update, context, tasks):
+            return
 
-        photo_file = await update.message.photo[-1].get_file()
-        image_id = str(update.message.message_id)
-        context.user_data["image_id"] = image_id
-        config = context.bot_data["config"]
-        image_folder = utils.create_image_folder(image_id, config)
-        original_path = os.path.join(image_folder, f"original_{image_id}.jpg")
-        await photo_file.download_to_drive(original_path)
-
-        config = context.bot_data["config"]  # Access config from bot_data
-
-        if task == "object_detection":
-            model_data = context.bot_data["object_detection_model_data"]
-            result = await object_detection.process_image(
-                original_path,
-                image_folder,
-                image_id,
-                model_data,
-                config["models"]["object_detection"],
-            )
-        elif task == "nudity_detection":
-            detector = context.bot_data["nudity_detection_detector"]
-            result = await nudity_detection.process_image(
-                original_path,
-                image_folder,
-                image_id,
-                detector,
-                config["models"]["nudity_detection"],
-            )
-        elif task == "image_segmentation":
-            model = context.bot_data["image_segmentation_model"]
-            result = await image_segmentation.process_image(
-                original_path,
-                image_folder,
-                image_id,
-                model,
-                config["models"]["image_segmentation"],
-            )
-        elif task == "text_extraction":
-            result = await text_extraction.process_image(
-                original_path, image_folder, image_id
-            )
-        elif task == "background_removal":
-            result = await background_removal.process_image(
-                original_path, image_folder, image_id
-            )
-        elif task == "emotion_recognition":
-            result = await emotion_recognition.process_image(
-                original_path,
-                image_folder,
-                image_id,
-                config["models"]["emotion_recognition"],
-            )
-
-        result_handlers = {
-            "text_extraction": utils.send_text_result,
-            "emotion_recognition": utils.send_emotion_result,
-        }
-
-        if task in result_handlers:
+        with metrics.span("request", task):
+            if task == "combo":
+                await combo_handler(update, context)
+            else:
+                await single_handler(update, context, task)
+
+    except Exception as e:
+        utils.logger.error(f"Photo processing error: {e}")
+        await handle_error(update, context)
+        await utils.cleanup_operation(update, context)
+
+
+async def single_handler(update: Update, context: CallbackContext, task: str):
+    config = context.bot_data["config"]
+    cache = context.bot_data["result_cache"]
+    source = utils.select_image_source(
+        update.message, config["models"][task].get("max_input_side")
+    )
+    cache_keys = [cache.make_key(source.file_unique_id, task, config["models"][task])]
+
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, cache.get, cache_keys[0])
+
+    if result is None:
+        pool = context.bot_data["scheduler"].pool(task)
+        try:
+            pool.reserve()
+        except SchedulerBusyError:
+            utils.logger.warning(f"Rejected {task} request: queue is full")
+            await refund_rate_limit(update, context, [task])
+            await update.message.reply_text(
+                Strings.BUSY, reply_to_message_id=update.message.message_id
+            )
+            return
+
+        try:
+            await utils.delete_prev_messages(update, context)
+            ack_message, [(image_bytes, image)] = await acknowledge_and_download(
+                update, context, [pool], [source]
+            )
+        except Exception:
+            pool.release()
+            raise
+
+        progress = None
+        if stream_interval := config["models"][task].get("stream_interval_seconds"):
+            progress = utils.progress_editor(ack_message, stream_interval)
+        content, result = await run_uncached(
+            task, image_bytes, image, context, progress
+        )
+        cache_keys.append(content)
+
+        if config["app"].get("persist_images", False):
+            await loop.run_in_executor(
+                None,
+                utils.persist_images,
+                workspace_dir(
+                    config, update.effective_chat.id, update.message.message_id
+                ),
+                task,
+                image_bytes,
+                result,
+            )
+        await loop.run_in_executor(None, cache.put_all, cache_keys, result)
+    else:
+        utils.logger.info(f"Serving cached {task} result")
+        await utils.delete_prev_messages(update, context)
+
+    result_handlers = {
+        "text_extraction": utils.send_text_result,
+        "emotion_recognition": utils.send_emotion_result,
+    }
+
+    if task in result_handlers:
+        with metrics.span("upload"):
             await result_handlers[task](
                 update, result, context.user_data["task_message"]
             )
-        else:
-            await utils.send_processed_result(
-                update, result, context.user_data["task_message"]
+    else:
+        with metrics.span("upload"):
+            sent_msg = await utils.send_processed_result(
+                update,
+                result,
+                context.user_data["task_message"],
+                context.bot_data["file_ids"],
+            )
+        if sent_msg and sent_msg.photo and "file_id" not in result:
+            await loop.run_in_executor(
+                None, cache.set_file_ids, cache_keys, sent_msg.photo[-1].file_id
             )
 
-        await utils.cleanup_operation(update, context)
-        await keyboards.send_main_menu(update, context)
+    await utils.cleanup_operation(update, context)
+    utils.in_background(context, keyboards.send_main_menu(update, context), "Main menu")
+
+
+async def combo_handler(update: Update, context: CallbackContext):
+    """Run every selected task on one download of the photo, concurrently"""
+    tasks = context.user_data.get("combo_tasks", [])
+    config = context.bot_data["config"]
+    cache = context.bot_data["result_cache"]
+    scheduler = context.bot_data["scheduler"]
+
+    # One download has to serve every task, so fetch the largest size any of them wants
+    max_sides = [config["models"][task].get("max_input_side") for task in tasks]
+    source = utils.select_image_source(
+        update.message, max(max_sides) if all(max_sides) else None
+    )
+    cache_keys = {
+        task: [cache.make_key(source.file_unique_id, task, config["models"][task])]
+        for task in tasks
+    }
+
+    loop = asyncio.get_event_loop()
+    outcomes = {}
+    for task in tasks:
+        if cached := await loop.run_in_executor(None, cache.get, cache_keys[task][0]):
+            outcomes[task] = cached
+
+    reserved, busy = [], []
+    for task in tasks:
+        if task in outcomes:
+            continue
+        try:
+            scheduler.pool(task).reserve()
+            reserved.append(task)
+        except SchedulerBusyError:
+            utils.logger.warning(f"Rejected {task} in combo request: queue is full")
+            outcomes[task] = Strings.TASK_BUSY
+            busy.append(task)
+    await refund_rate_limit(update, context, busy)
 
+    await utils.delete_prev_messages(update, context)
+    if reserved:
+        try:
+            _, [(image_bytes, image)] = await acknowledge_and_download(
+                update, context, [scheduler.pool(task) for task in reserved], [source]
+            )
+        except Exception:
+            for task in reserved:
+                scheduler.pool(task).release()
+            raise
+
+        results = await asyncio.gather(
+            *(run_uncached(task, image_bytes, image, context) for task in reserved),
+            return_exceptions=True,
+        )
+        for task, outcome in zip(reserved, results):
+            if isinstance(outcome, Exception):
+                # One failing task must not discard the others
+                utils.logger.error(f"Combo {task} failed: {outcome}")
+                outcomes[task] = str(outcome) or Strings.PROCESSING_ERROR.format(task)
+                continue
+
+            content, result = outcome
+            cache_keys[task].append(content)
+            outcomes[task] = result
+            if config["app"].get("persist_images", False):
+                await loop.run_in_executor(
+                    None,
+                    utils.persist_images,
+                    workspace_dir(
+                        config, update.effective_chat.id, update.message.message_id
+                    ),
+                    task,
+                    image_bytes,
+                    result,
+                )
+            await loop.run_in_executor(None, cache.put_all, cache_keys[task], result)
+
+    with metrics.span("upload"):
+        sent = await utils.send_result_group(
+            update,
+            [
+                (task, task, Strings.MENU_ITEMS[task][2], outcomes[task])
+                for task in tasks
+            ],
+            context.bot_data["file_ids"],
+        )
+    for task, message in sent:
+        if message.photo and "file_id" not in outcomes[task]:
+            await loop.run_in_executor(
+                None, cache.set_file_ids, cache_keys[task], message.photo[-1].file_id
+            )
+
+    await utils.cleanup_operation(update, context)
+    utils.in_background(context, keyboards.send_main_menu(update, context), "Main menu")
+
+
+async def collect_album(update: Update, context: CallbackContext):
+    """Buffer the photos of an album until no more have arrived for a moment"""
+    albums = context.chat_data.setdefault("albums", {})
+    group_id = update.message.media_group_id
+
+    if album := albums.get(group_id):
+        album["updates"].append(update)
+        album["last_seen"] = time.monotonic()
+        return
+
+    albums[group_id] = {"updates": [update], "last_seen": time.monotonic()}
+    # Run detached so the remaining album updates aren't held up behind this one
+    context.application.create_task(flush_album(group_id, context), update=update)
+
+
+async def flush_album(group_id: str, context: CallbackContext):
+    config = context.bot_data["config"]
+    window = config["app"].get("album_window_ms", 800) / 1000
+    albums = context.chat_data["albums"]
+    album = albums[group_id]
+
+    while (remaining := album["last_seen"] + window - time.monotonic()) > 0:
+        await asyncio.sleep(remaining)
+    del albums[group_id]
+
+    updates = sorted(album["updates"], key=lambda u: u.message.message_id)
+    metrics.REQUEST_ID.set(f"{updates[0].effective_chat.id}:album:{group_id}")
+    OWNER.set(updates[0].effective_user and updates[0].effective_user.id)
+    try:
+        with metrics.span("request", context.user_data.get("task")):
+            await album_handler(updates, context)
     except Exception as e:
-        utils.logger.error(f"Photo processing error: {e}")
-        await handle_error(update, context)
-        await utils.cleanup_operation(update, context)
+        utils.logger.error(f"Album processing error: {e}")
+        await handle_error(updates[0], context)
+        await utils.cleanup_operation(updates[0], context)
+
+
+async def album_handler(updates: list, context: CallbackContext):
+    """Run the selected task on every photo of an album and reply with one group"""
+    update = updates[0]
+    task = context.user_data.get("task")
+    if task == "combo":
+        await update.message.reply_text(
+            Strings.COMBO_ALBUM, reply_to_message_id=update.message.message_id
+        )
+        return
+    if not await within_rate_limit(update, context, [task] * len(updates)):
+        return
+
+    config = context.bot_data["config"]
+    cache = context.bot_data["result_cache"]
+    pool = context.bot_data["scheduler"].pool(task)
+    max_side = config["models"][task].get("max_input_side")
+    sources = [utils.select_image_source(u.message, max_side) for u in updates]
+    cache_keys = [
+        [cache.make_key(source.file_unique_id, task, config["models"][task])]
+        for source in sources
+    ]
+
+    loop = asyncio.get_event_loop()
+    outcomes = [
+        await loop.run_in_executor(None, cache.get, keys[0]) for keys in cache_keys
+    ]
+
+    pending, busy = [], []
+    for index, outcome in enumerate(outcomes):
+        if outcome is not None:
+            continue
+        try:
+            pool.reserve()
+            pending.append(index)
+        except SchedulerBusyError:
+            utils.logger.warning(f"Rejected {task} album photo: queue is full")
+            outcomes[index] = Strings.TASK_BUSY
+            busy.append(task)
+    await refund_rate_limit(update, context, busy)
+
+    await utils.delete_prev_messages(update, context)
+    if pending:
+        try:
+            _, downloads = await acknowledge_and_download(
+                update, context, [pool], [sources[i] for i in pending]
+            )
+        except Exception:
+            for _ in pending:
+                pool.release()
+            raise
+
+        # Submitted together and without per-photo worker slots, so batching
+        # models run the whole album (up to max_batch_size) as one batch
+        results = await asyncio.gather(
+            *(
+                run_uncached(task, image_bytes, image, context)
+                for image_bytes, image in downloads
+            ),
+            return_exceptions=True,
+        )
+        for index, (image_bytes, _), outcome in zip(pending, downloads, results):
+            if isinstance(outcome, Exception):
+                utils.logger.error(f"Album {task} failed: {outcome}")
+                outcomes[index] = str(outcome) or Strings.PROCESSING_ERROR.format(task)
+                continue
+
+            content, result = outcome
+            cache_keys[index].append(content)
+            outcomes[index] = result
+            if config["app"].get("persist_images", False):
+                await loop.run_in_executor(
+                    None,
+                    utils.persist_images,
+                    workspace_dir(
+                        config,
+                        update.effective_chat.id,
+                        updates[index].message.message_id,
+                    ),
+                    task,
+                    image_bytes,
+                    result,
+                )
+            await loop.run_in_executor(None, cache.put_all, cache_keys[index], result)
+
+    task_name = context.user_data["task_message"]
+    with metrics.span("upload"):
+        sent = await utils.send_result_group(
+            update,
+            [
+                (index, task, Strings.ALBUM_ITEM.format(task_name, index + 1), outcome)
+                for index, outcome in enumerate(outcomes)
+            ],
+            context.bot_data["file_ids"],
+        )
+    for index, message in sent:
+        if message.photo and "file_id" not in outcomes[index]:
+            await loop.run_in_executor(
+                None, cache.set_file_ids, cache_keys[index], message.photo[-1].file_id
+            )
+
+    await utils.cleanup_operation(update, context)
+    utils.in_background(context, keyboards.send_main_menu(update, context), "Main menu")
+
+
+async def within_rate_limit(update: Update, context: CallbackContext, tasks) -> bool:
+    """Charge the user and chat for ``tasks``, or tell them when to come back"""
+    limiter = context.bot_data["rate_limiter"]
+    cost = sum(limiter.cost(task) for task in tasks)
+    user_id = update.effective_user and update.effective_user.id
+
+    loop = asyncio.get_event_loop()
+    wait = await loop.run_in_executor(
+        None, limiter.acquire, user_id, update.effective_chat.id, cost
+    )
+    if not wait:
+        return True
+
+    utils.logger.warning(f"Rate limited {user_id}: retry in {wait:.0f}s")
+    for task in set(tasks):
+        metrics.RATE_LIMITED.inc(task=task)
+    await update.message.reply_text(
+        Strings.RATE_LIMITED.format(utils.format_wait(wait)),
+        reply_to_message_id=update.message.message_id,
+    )
+    return False
+
+
+async def refund_rate_limit(update: Update, context: CallbackContext, tasks):
+    """Give back what ``within_rate_limit`` charged for tasks turned away as busy"""
+    if not tasks:
+        return
+    limiter = context.bot_data["rate_limiter"]
+    cost = sum(limiter.cost(task) for task in tasks)
+    user_id = update.effective_user and update.effective_user.id
+
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(
+        None, limiter.refund, user_id, update.effective_chat.id, cost
+    )
+
+
+async def acknowledge_and_download(
+    update: Update, context: CallbackContext, pools: list, sources: list
+):
+    """Send the "processing" ack and fetch the photos at the same time.
+
+    Neither waits for the other's round trips; returns the ack message and
+    the ``(image_bytes, image)`` downloads.
+    """
+    decode = context.bot_data["jobs"].local
+    ack_message, *downloads = await asyncio.gather(
+        update.message.reply_text(
+            utils.processing_message(pools, OWNER.get()),
+            reply_to_message_id=update.message.message_id,
+        ),
+        *(download_photo(source, decode=decode) for source in sources),
+        return_exceptions=True,
+    )
+    # Record the ack even if a download failed, so cleanup can delete it
+    if not isinstance(ack_message, Exception):
+        context.user_data["prev_message"] = ack_message.message_id
+    for outcome in (ack_message, *downloads):
+        if isinstance(outcome, Exception):
+            raise outcome
+    return ack_message, downloads
+
+
+async def download_photo(source, decode: bool = True):
+    """Download a photo or image document once into memory and decode it.
+
+    Remote workers decode the bytes themselves, so ``decode`` can be turned off.
+    """
+    with metrics.span("download"):
+        photo_file = await source.get_file()
+        image_bytes = bytes(await photo_file.download_as_bytearray())
+    if not decode:
+        return image_bytes, None
+
+    loop = asyncio.get_event_loop()
+    with metrics.span("decode"):
+        image = await loop.run_in_executor(None, image_utils.decode_image, image_bytes)
+    return image_bytes, image
+
+
+async def run_uncached(
+    task: str, image_bytes: bytes, image, context: CallbackContext, progress=None
+) -> Tuple[str, dict]:
+    """Run a reserved task unless the downloaded image's result is cached.
+
+    The same picture uploaded again gets a new file id, so only its bytes show
+    it is a repeat. Returns the content cache key along with the result.
+    """
+    cache = context.bot_data["result_cache"]
+    task_config = context.bot_data["config"]["models"][task]
+    loop = asyncio.get_event_loop()
+    key = await loop.run_in_executor(
+        None, lambda: cache.make_key(content_key(image_bytes), task, task_config)
+    )
+    if (cached := await loop.run_in_executor(None, cache.get, key)) is not None:
+        context.bot_data["scheduler"].pool(task).release()
+        utils.logger.info(f"Serving cached {task} result for a re-uploaded image")
+        return key, cached
+    return key, await run_reserved(task, image_bytes, image, context, progress)
+
+
+async def run_reserved(
+    task: str, image_bytes: bytes, image, context: CallbackContext, progress=None
+) -> dict:
+    """Submit a job for a task; the caller must already hold a reservation"""
+    try:
+        return await context.bot_data["jobs"].submit(task, image_bytes, image, progress)
+    finally:
+        context.bot_data["scheduler"].pool(task).release()
 
 
 async def cancel_handler(update: Update, context: CallbackContext):
     await utils.cleanup_operation(update, context)
     await update.message.reply_text(Strings.OPERATION_CANCELLED)
-    await keyboards.send_main_menu(update, context)
+    utils.in_background(context, keyboards.send_main_menu(update, context), "Main menu")
 
 
 async def handle_error(update: Update, context: CallbackContext):
@@ -159,5 +570,7 @@ def register_handlers(app):
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(CommandHandler("cancel", cancel_handler))
     app.add_handler(CallbackQueryHandler(button_handler))
-    app.add_handler(MessageHandler(filters.PHOTO, photo_handler))
+    app.add_handler(
+        MessageHandler(filters.PHOTO | filters.Document.IMAGE, photo_handler)
+    )
     app.add_error_handler(lambda update, context: handle_error(update, context))
@@ -0,0 +1,310 @@
+"""Job queue between the Telegram front-end and the inference workers.
+
+The in-process backend runs tasks right here, as before. The SQLite and Redis
+backends put jobs on a shared queue that ``worker.py`` processes pick up, so
+model hosts can scale independently of the bot. Payloads are pickled, so only
+point the bot and workers at a queue you trust.
+"""
+
+import io
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from bot.strings import Strings
+from bot.tasks import run_on_pool
+from models import image_utils
+
+logger = logging.getLogger(__name__)
+
+
+def to_wire(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the in-memory image buffer with plain bytes for transport"""
+    payload = dict(result)
+    if image_buffer := payload.pop("image_buffer", None):
+        payload["image_bytes"] = image_buffer.getvalue()
+        payload["image_name"] = getattr(image_buffer, "name", "result.jpg")
+    return payload
+
+
+def from_wire(payload: Dict[str, Any]) -> Dict[str, Any]:
+    result = dict(payload)
+    if (image_bytes := result.pop("image_bytes", None)) is not None:
+        image_buffer = io.BytesIO(image_bytes)
+        image_buffer.name = result.pop("image_name", "result.jpg")
+        result["image_buffer"] = image_buffer
+    return result
+
+
+class InProcessBackend:
+    """Runs jobs on this process's scheduler pools"""
+
+    local = True
+
+    def __init__(self, resources: Dict[str, Any]):
+        self.resources = resources
+
+    async def submit(
+        self, task: str, image_bytes: bytes, image=None, progress=None
+    ) -> dict:
+        if image is None:
+            loop = asyncio.get_event_loop()
+            image = await loop.run_in_executor(
+                None, image_utils.decode_image, image_bytes
+            )
+        return await run_on_pool(task, image, self.resources, progress)
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Job queue in a shared SQLite file, for workers on the same host or volume"""
+
+    local = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            task TEXT NOT NULL,
+            payload BLOB,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            result BLOB,
+            error TEXT,
+            created REAL NOT NULL,
+            started REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, task, created);
+        CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY,
+            tasks TEXT NOT NULL,
+            heartbeat REAL NOT NULL
+        );
+    """
+
+    def __init__(self, jobs_config: Dict[str, Any]):
+        self.path = jobs_config.get("sqlite_path", "jobs.sqlite3")
+        self.timeout = jobs_config.get("timeout_seconds", 120)
+        self.poll_interval = jobs_config.get("poll_interval_ms", 50) / 1000
+        self.worker_ttl = jobs_config.get("heartbeat_seconds", 10) * 3
+        self._local = threading.local()
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across the executor's threads
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+    async def submit(
+        self, task: str, image_bytes: bytes, image=None, progress=None
+    ) -> dict:
+        # Partial results are not relayed from workers; ``progress`` is ignored
+        if task not in await self.served_tasks():
+            raise RuntimeError(Strings.NO_WORKER.format(task))
+
+        job_id = uuid.uuid4().hex
+        await self._run(self._insert, job_id, task, image_bytes)
+
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            status, result, error = await self._run(self._status, job_id)
+            if status == "done":
+                return from_wire(pickle.loads(result))
+            if status == "failed":
+                raise RuntimeError(error)
+            await asyncio.sleep(self.poll_interval)
+
+        await self._run(self._delete, job_id)
+        raise RuntimeError(Strings.JOB_TIMEOUT.format(task))
+
+    async def claim(self, tasks: List[str], worker_id: str) -> Optional[dict]:
+        while True:
+            if job := await self._run(self._claim, tasks, worker_id):
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def complete(self, job_id: str, result: dict):
+        await self._run(
+            self._finish, job_id, "done", pickle.dumps(to_wire(result)), None
+        )
+
+    async def fail(self, job_id: str, error: str):
+        await self._run(self._finish, job_id, "failed", None, error)
+
+    async def advertise(self, worker_id: str, tasks: List[str]):
+        await self._run(self._heartbeat, worker_id, tasks)
+
+    async def served_tasks(self) -> set:
+        workers = await self._run(self._workers)
+        return {task for tasks in workers.values() for task in tasks}
+
+    async def close(self):
+        pass
+
+    def _insert(self, job_id: str, task: str, image_bytes: bytes):
+        self._connection().execute(
+            "INSERT INTO jobs (id, task, payload, created) VALUES (?, ?, ?, ?)",
+            (job_id, task, image_bytes, time.time()),
+        )
+
+    def _status(self, job_id: str):
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row and row[0] in ("done", "failed"):
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return row or (None, None, None)
+
+    def _delete(self, job_id: str):
+        self._connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _claim(self, tasks: List[str], worker_id: str) -> Optional[dict]:
+        connection = self._connection()
+        placeholders = ",".join("?" * len(tasks))
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                f"SELECT id, task, payload FROM jobs WHERE status = 'pending' "
+                f"AND task IN ({placeholders}) ORDER BY created LIMIT 1",
+                tasks,
+            ).fetchone()
+            if row:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, started = ? "
+                    "WHERE id = ?",
+                    (worker_id, time.time(), row[0]),
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        if row:
+            return {"id": row[0], "task": row[1], "image_bytes": row[2]}
+        return None
+
+    def _finish(self, job_id: str, status: str, result, error: Optional[str]):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL "
+            "WHERE id = ?",
+            (status, result, error, job_id),
+        )
+
+    def _heartbeat(self, worker_id: str, tasks: List[str]):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO workers (id, tasks, heartbeat) VALUES (?, ?, ?)",
+            (worker_id, json.dumps(tasks), time.time()),
+        )
+
+    def _workers(self) -> Dict[str, List[str]]:
+        rows = self._connection().execute(
+            "SELECT id, tasks FROM workers WHERE heartbeat > ?",
+            (time.time() - self.worker_ttl,),
+        )
+        return {worker_id: json.loads(tasks) for worker_id, tasks in rows}
+
+
+class RedisBackend:
+    """Job queue on Redis (or any Redis-compatible server), one list per task"""
+
+    local = False
+
+    def __init__(self, jobs_config: Dict[str, Any]):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(jobs_config.get("redis_url", "redis://localhost"))
+        self.prefix = jobs_config.get("key_prefix", "snapsense")
+        self.timeout = jobs_config.get("timeout_seconds", 120)
+        self.worker_ttl = jobs_config.get("heartbeat_seconds", 10) * 3
+
+    def _queue(self, task: str) -> str:
+        return f"{self.prefix}:queue:{task}"
+
+    def _result(self, job_id: str) -> str:
+        return f"{self.prefix}:result:{job_id}"
+
+    async def submit(
+        self, task: str, image_bytes: bytes, image=None, progress=None
+    ) -> dict:
+        # Partial results are not relayed from workers; ``progress`` is ignored
+        if task not in await self.served_tasks():
+            raise RuntimeError(Strings.NO_WORKER.format(task))
+
+        job_id = uuid.uuid4().hex
+        await self.redis.lpush(
+            self._queue(task),
+            pickle.dumps({"id": job_id, "task": task, "image_bytes": image_bytes}),
+        )
+
+        reply = await self.redis.brpop([self._result(job_id)], timeout=self.timeout)
+        if reply is None:
+            raise RuntimeError(Strings.JOB_TIMEOUT.format(task))
+
+        payload = pickle.loads(reply[1])
+        if "error" in payload:
+            raise RuntimeError(payload["error"])
+        return from_wire(payload["result"])
+
+    async def claim(self, tasks: List[str], worker_id: str) -> Optional[dict]:
+        while True:
+            reply = await self.redis.brpop(
+                [self._queue(task) for task in tasks], timeout=1
+            )
+            if reply is not None:
+                return pickle.loads(reply[1])
+
+    async def complete(self, job_id: str, result: dict):
+        await self._reply(job_id, {"result": to_wire(result)})
+
+    async def fail(self, job_id: str, error: str):
+        await self._reply(job_id, {"error": error})
+
+    async def _reply(self, job_id: str, payload: dict):
+        key = self._result(job_id)
+        await self.redis.lpush(key, pickle.dumps(payload))
+        # Nobody will read it if the front-end already gave up on this job
+        await self.redis.expire(key, self.timeout)
+
+    async def advertise(self, worker_id: str, tasks: List[str]):
+        await self.redis.hset(
+            f"{self.prefix}:workers",
+            worker_id,
+            json.dumps({"tasks": tasks, "heartbeat": time.time()}),
+        )
+
+    async def served_tasks(self) -> set:
+        workers = await self.redis.hgetall(f"{self.prefix}:workers")
+        served = set()
+        for info in workers.values():
+            info = json.loads(info)
+            if time.time() - info["heartbeat"] < self.worker_ttl:
+                served.update(info["tasks"])
+        return served
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_backend(config: Dict[str, Any], resources: Dict[str, Any]):
+    jobs_config = config.get("jobs", {})
+    backend = jobs_config.get("backend", "inprocess")
+
+    if backend == "inprocess":
+        return InProcessBackend(resources)
+    if backend == "sqlite":
+        return SQLiteBackend(jobs_config)
+    if backend == "redis":
+        return RedisBackend(jobs_config)
+    raise ValueError(f"Unknown job queue backend: {backend}")
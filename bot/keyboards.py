@@ -8,6 +8,28 @@ def main_menu():
         [InlineKeyboardButton(text, callback_data=cb_data)]
         for text, cb_data, _ in Strings.MENU_ITEMS.values()
     ]
+    combo_text, combo_data, _ = Strings.COMBO_ITEM
+    buttons.append([InlineKeyboardButton(combo_text, callback_data=combo_data)])
+    return InlineKeyboardMarkup(buttons)
+
+
+def combo_menu(selected):
+    buttons = [
+        [
+            InlineKeyboardButton(
+                Strings.COMBO_SELECTED.format(text) if task_id in selected else text,
+                callback_data=f"{Strings.COMBO_TOGGLE_PREFIX}{task_id}",
+            )
+        ]
+        for task_id, (text, _, _) in Strings.MENU_ITEMS.items()
+    ]
+    buttons.append(
+        [
+            InlineKeyboardButton(
+                Strings.COMBO_RUN_BUTTON, callback_data=Strings.COMBO_RUN_CALLBACK
+            )
+        ]
+    )
     return InlineKeyboardMarkup(buttons)
 
 
@@ -0,0 +1,209 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (bucket key, capacity, refill per second)
+Bucket = Tuple[str, float, float]
+
+
+class MemoryBuckets:
+    """Token buckets for a single bot process"""
+
+    def __init__(self, max_buckets: int = 10000):
+        self.max_buckets = max_buckets
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, buckets: List[Bucket], cost: float) -> float:
+        with self._lock:
+            now = time.time()
+            levels = [
+                _refill(self._buckets.get(key), capacity, rate, now)
+                for key, capacity, rate in buckets
+            ]
+            wait = _wait(buckets, levels, cost)
+            if wait == 0:
+                for (key, capacity, rate), tokens in zip(buckets, levels):
+                    self._buckets[key] = (
+                        tokens - min(cost, capacity),
+                        now,
+                        capacity,
+                        rate,
+                    )
+                if len(self._buckets) > self.max_buckets:
+                    self._prune(now)
+            return wait
+
+    def give(self, buckets: List[Bucket], amount: float):
+        with self._lock:
+            now = time.time()
+            for key, capacity, rate in buckets:
+                if (state := self._buckets.get(key)) is not None:
+                    tokens = _refill(state, capacity, rate, now)
+                    self._buckets[key] = (
+                        min(capacity, tokens + amount),
+                        now,
+                        capacity,
+                        rate,
+                    )
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket at all
+        for key, state in list(self._buckets.items()):
+            tokens, updated, capacity, rate = state
+            if tokens + (now - updated) * rate >= capacity:
+                del self._buckets[key]
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file shared by several bot processes on one host"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def take(self, buckets: List[Bucket], cost: float) -> float:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            levels = []
+            for key, capacity, rate in buckets:
+                row = connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                levels.append(_refill(row, capacity, rate, now))
+
+            wait = _wait(buckets, levels, cost)
+            if wait == 0:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (key, tokens - min(cost, capacity), now)
+                        for (key, capacity, _), tokens in zip(buckets, levels)
+                    ],
+                )
+            connection.execute("COMMIT")
+            return wait
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def give(self, buckets: List[Bucket], amount: float):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            for key, capacity, rate in buckets:
+                row = connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    tokens = _refill(row, capacity, rate, now)
+                    connection.execute(
+                        "UPDATE buckets SET tokens = ?, updated = ? WHERE key = ?",
+                        (min(capacity, tokens + amount), now, key),
+                    )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def _refill(state, capacity: float, rate: float, now: float) -> float:
+    if state is None:
+        return capacity
+    tokens, updated = state[0], state[1]
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _wait(buckets: List[Bucket], levels: List[float], cost: float) -> float:
+    """Seconds until every bucket holds enough tokens, 0 if they already do"""
+    wait = 0.0
+    for (_, capacity, rate), tokens in zip(buckets, levels):
+        # A request can never need more than a full bucket
+        missing = min(cost, capacity) - tokens
+        if missing > 0:
+            wait = max(wait, missing / rate if rate else float("inf"))
+    return wait
+
+
+class RateLimiter:
+    """Token-bucket limits per user, per chat and for the whole bot.
+
+    Each task costs its configured weight in tokens, so a SAM request uses up a
+    user's allowance much faster than an OCR request.
+    """
+
+    SCOPES = ("user", "chat", "global")
+
+    def __init__(self, config: Dict[str, Any]):
+        limits_config = config.get("rate_limits", {})
+        self.enabled = limits_config.get("enabled", False)
+        self.costs: Dict[str, float] = limits_config.get("costs", {})
+
+        self.limits: Dict[str, Tuple[float, float]] = {}
+        for scope in self.SCOPES:
+            if settings := limits_config.get(scope):
+                self.limits[scope] = (
+                    float(settings["capacity"]),
+                    float(settings["refill_per_minute"]) / 60,
+                )
+
+        if limits_config.get("backend", "memory") == "sqlite":
+            self.buckets = SQLiteBuckets(limits_config["sqlite_path"])
+        else:
+            self.buckets = MemoryBuckets()
+
+    def cost(self, task: str) -> float:
+        return float(self.costs.get(task, 1))
+
+    def acquire(
+        self, user_id: Optional[int], chat_id: Optional[int], cost: float
+    ) -> float:
+        """Take ``cost`` tokens; returns 0 on success, else seconds to wait"""
+        if not self.enabled or not self.limits:
+            return 0.0
+
+        try:
+            return self.buckets.take(self._buckets(user_id, chat_id), cost)
+        except Exception as e:
+            # Never turn users away because the limiter itself is broken
+            logger.error(f"Rate limiter failed, allowing request: {e}")
+            return 0.0
+
+    def refund(self, user_id: Optional[int], chat_id: Optional[int], cost: float):
+        """Give back tokens for work that was charged but never ran"""
+        if not self.enabled or not self.limits or not cost:
+            return
+
+        try:
+            self.buckets.give(self._buckets(user_id, chat_id), cost)
+        except Exception as e:
+            logger.error(f"Rate limiter refund failed: {e}")
+
+    def _buckets(self, user_id: Optional[int], chat_id: Optional[int]) -> List[Bucket]:
+        owners = {"user": user_id, "chat": chat_id, "global": "all"}
+        return [
+            (f"{scope}:{owners[scope]}", capacity, rate)
+            for scope, (capacity, rate) in self.limits.items()
+            if owners[scope] is not None
+        ]
@@ -0,0 +1,336 @@
+"""Prometheus-style metrics and per-stage latency spans.
+
+Spans time one stage of a request (download, decode, queue wait, inference,
+upload, ...) into a histogram labelled by task and stage, count failures by
+exception type, and track how many are in flight. Every span carries the
+request id from ``REQUEST_ID`` so the JSON log lines of one request can be
+correlated. ``start_server`` exposes everything on ``/metrics``.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("snapsense.trace")
+
+REQUEST_ID: contextvars.ContextVar = contextvars.ContextVar("request_id", default="")
+CURRENT_TASK: contextvars.ContextVar = contextvars.ContextVar("task", default="")
+
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts, then sum and count
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """``collector`` refreshes gauges from live state right before each scrape"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "snapsense_stage_seconds",
+        "Time spent in each stage of a request.",
+        ("task", "stage"),
+    )
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge("snapsense_in_flight", "Stages currently running.", ("task", "stage"))
+)
+ERRORS = REGISTRY.register(
+    Counter(
+        "snapsense_errors_total",
+        "Failed stages by exception type.",
+        ("task", "stage", "exception"),
+    )
+)
+ENCODE_SECONDS = REGISTRY.register(
+    Histogram(
+        "snapsense_encode_seconds", "Time spent encoding result images.", ("format",)
+    )
+)
+BATCH_SIZE = REGISTRY.register(
+    Histogram(
+        "snapsense_batch_size",
+        "Requests run together in one batched model call.",
+        ("task",),
+        buckets=(1, 2, 4, 8, 16, 32, 64),
+    )
+)
+FACE_DETECTION_SECONDS = REGISTRY.register(
+    Histogram(
+        "snapsense_face_detection_seconds",
+        "Time spent finding faces, by detector backend.",
+        ("backend",),
+    )
+)
+ENCODE_SAVED_BYTES = REGISTRY.register(
+    Counter(
+        "snapsense_encode_saved_bytes_total",
+        "Bytes saved by picking a smaller encoding than the first candidate.",
+        ("format",),
+    )
+)
+MODEL_LOAD_SECONDS = REGISTRY.register(
+    Histogram(
+        "snapsense_model_load_seconds",
+        "Time spent loading each model.",
+        ("model",),
+    )
+)
+MODEL_LOADED = REGISTRY.register(
+    Gauge("snapsense_model_loaded", "1 while a model is in memory.", ("model",))
+)
+SCHEDULER_PENDING = REGISTRY.register(
+    Gauge(
+        "snapsense_scheduler_pending",
+        "Requests holding a scheduler reservation.",
+        ("task",),
+    )
+)
+SCHEDULER_CAPACITY = REGISTRY.register(
+    Gauge(
+        "snapsense_scheduler_capacity",
+        "Reservations a task accepts before turning requests away.",
+        ("task",),
+    )
+)
+SCHEDULER_WAITING = REGISTRY.register(
+    Gauge(
+        "snapsense_scheduler_waiting",
+        "Requests waiting for a free worker slot.",
+        ("task",),
+    )
+)
+RATE_LIMITED = REGISTRY.register(
+    Counter(
+        "snapsense_rate_limited_total",
+        "Requests turned away by a rate limit.",
+        ("task",),
+    )
+)
+CACHE_LOOKUPS = REGISTRY.register(
+    Counter("snapsense_cache_lookups_total", "Result cache lookups.", ("result",))
+)
+CACHE_ENTRIES = REGISTRY.register(
+    Gauge("snapsense_cache_entries", "Results held in the in-memory cache.")
+)
+CACHE_BYTES = REGISTRY.register(
+    Gauge("snapsense_cache_bytes", "Approximate size of the in-memory cache.")
+)
+FILE_ID_LOOKUPS = REGISTRY.register(
+    Counter(
+        "snapsense_file_id_lookups_total",
+        "Uploads answered from (hit) or missing in (miss) the file id store.",
+        ("result",),
+    )
+)
+
+_log_json = False
+
+
+def configure(config: Dict):
+    global _log_json
+    _log_json = config.get("metrics", {}).get("log_json", False)
+
+
+def observe(stage: str, seconds: float, task: Optional[str] = None, status="ok"):
+    task = task or CURRENT_TASK.get()
+    STAGE_SECONDS.observe(seconds, task=task, stage=stage)
+    if _log_json:
+        trace_logger.info(
+            json.dumps(
+                {
+                    "request_id": REQUEST_ID.get(),
+                    "task": task,
+                    "stage": stage,
+                    "duration_ms": round(seconds * 1000, 2),
+                    "status": status,
+                }
+            )
+        )
+
+
+@contextmanager
+def span(stage: str, task: Optional[str] = None):
+    """Time the enclosed block as ``stage``.
+
+    ``task`` defaults to the task of the enclosing span; passing one also sets
+    it for spans nested inside.
+    """
+    token = CURRENT_TASK.set(task) if task else None
+    task = task or CURRENT_TASK.get()
+    IN_FLIGHT.inc(task=task, stage=stage)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except BaseException as e:
+        status = "error"
+        ERRORS.inc(task=task, stage=stage, exception=type(e).__name__)
+        raise
+    finally:
+        IN_FLIGHT.dec(task=task, stage=stage)
+        observe(stage, time.perf_counter() - started, task, status)
+        if token is not None:
+            CURRENT_TASK.reset(token)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"metrics: {format % args}")
+
+
+def start_server(host: str, port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
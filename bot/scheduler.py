@@ -0,0 +1,196 @@
+import heapq
+import time
+import asyncio
+import logging
+import itertools
+from contextvars import ContextVar
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TASKS = (
+    "object_detection",
+    "nudity_detection",
+    "image_segmentation",
+    "text_extraction",
+    "background_removal",
+    "emotion_recognition",
+)
+
+# Tasks whose work functions and arguments can be pickled into a worker process.
+# The others hold live model objects (torch, ONNX sessions) that must stay in-process.
+PROCESS_SAFE_TASKS = {"text_extraction"}
+
+# Tasks whose model runs requests through a MicroBatcher. The batcher hands a
+# whole batch to the executor as one job, so a request must not hold a worker
+# slot while it waits to join a batch: that would cap batches at max_workers.
+BATCHED_TASKS = {"object_detection", "nudity_detection", "emotion_recognition"}
+
+# Who the current request is running for; pools share their slots fairly between owners
+OWNER: ContextVar[Optional[Hashable]] = ContextVar("owner", default=None)
+
+
+class SchedulerBusyError(Exception):
+    """Raised when a task's queue is full and the request should be turned away"""
+
+
+class TaskPool:
+    """A bounded executor whose free slots go to waiting requests in fair order.
+
+    Each waiting request gets a virtual finish time: its owner's previous one
+    (or the pool's current virtual time, if later) plus one. The lowest finish
+    time runs next, so someone sending a burst of photos is interleaved with
+    everyone else instead of holding the queue until the burst is done.
+    """
+
+    def __init__(self, task: str, kind: str, max_workers: int, queue_size: int):
+        if kind == "process" and task not in PROCESS_SAFE_TASKS:
+            logger.warning(
+                f"{task} cannot run in a process pool, falling back to threads"
+            )
+            kind = "thread"
+
+        self.task = task
+        self.kind = kind
+        self.max_workers = max(1, int(max_workers))
+        self.queue_size = max(0, int(queue_size))
+        self.pending = 0
+        self.service_seconds = 0.0
+        self._active = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish: Dict[Hashable, float] = {}
+
+        if kind == "process":
+            self.executor: Executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=task
+            )
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_size
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def reserve(self):
+        if self.pending >= self.capacity:
+            raise SchedulerBusyError(self.task)
+        self.pending += 1
+
+    def release(self):
+        self.pending = max(0, self.pending - 1)
+
+    @asynccontextmanager
+    async def running(self):
+        owner = OWNER.get()
+        tag = self._finish_tag(owner)
+        self._finish[owner] = tag
+
+        if self._active < self.max_workers and not self._waiters:
+            self._active += 1
+        else:
+            future = asyncio.get_event_loop().create_future()
+            heapq.heappush(self._waiters, (tag, next(self._sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Handed a slot just as we were cancelled: pass it on
+                if future.done() and not future.cancelled():
+                    self._next()
+                raise
+
+        self._virtual_time = max(self._virtual_time, tag - 1)
+        started = time.perf_counter()
+        try:
+            yield self.executor
+        finally:
+            elapsed = time.perf_counter() - started
+            self.service_seconds = (
+                elapsed
+                if not self.service_seconds
+                else 0.8 * self.service_seconds + 0.2 * elapsed
+            )
+            self._next()
+
+    def _finish_tag(self, owner: Optional[Hashable]) -> float:
+        return max(self._virtual_time, self._finish.get(owner, 0.0)) + 1
+
+    def _next(self):
+        """Hand a finished request's slot to the next waiter in fair order"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+        # Owners who have caught up with the virtual clock need no bookkeeping
+        if len(self._finish) > 1000:
+            self._finish = {
+                owner: tag
+                for owner, tag in self._finish.items()
+                if tag > self._virtual_time
+            }
+
+    def estimate(self, owner: Optional[Hashable] = None) -> Tuple[int, float]:
+        """Queue position a new request from ``owner`` would get, and its expected wait.
+
+        Position 0 means it would start right away.
+        """
+        tag = self._finish_tag(owner)
+        ahead = sum(1 for t, _, f in self._waiters if t <= tag and not f.done())
+        if self._active < self.max_workers and not ahead:
+            return 0, 0.0
+        position = ahead + 1
+        return position, position * self.service_seconds / self.max_workers
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "waiting": self.waiting,
+        }
+
+
+class Scheduler:
+    """Owns one bounded executor per task so a flood of one task can't starve the rest"""
+
+    def __init__(self, config: Dict[str, Any]):
+        scheduler_config = config.get("scheduler", {})
+        defaults = scheduler_config.get("default", {})
+        overrides = scheduler_config.get("tasks", {})
+
+        self.pools: Dict[str, TaskPool] = {}
+        for task in TASKS:
+            settings = {**defaults, **overrides.get(task, {})}
+            self.pools[task] = TaskPool(
+                task,
+                kind=settings.get("executor", "thread"),
+                max_workers=settings.get("max_workers", 1),
+                queue_size=settings.get("queue_size", 4),
+            )
+            logger.info(f"Scheduler pool for {task}: {self.pools[task].stats()}")
+
+            batching = config.get("models", {}).get(task, {}).get("batching", {})
+            batch_size = batching.get("max_batch_size", 0)
+            if task in BATCHED_TASKS and batch_size > self.pools[task].capacity:
+                logger.warning(
+                    f"{task} admits {self.pools[task].capacity} requests, fewer "
+                    f"than its max_batch_size of {batch_size}: raise queue_size"
+                )
+
+    def pool(self, task: str) -> TaskPool:
+        return self.pools[task]
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,72 @@
+"""Startup timing: where the time goes between launching a process and serving.
+
+Milestones are measured from process start; imports and model loads by how
+long they took. Model loads run concurrently, so their durations overlap and
+do not add up to the time until everything is warm.
+"""
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+_timings: List[Tuple[str, str, float]] = []
+_lock = threading.Lock()
+_finished = False
+
+
+def uptime() -> float:
+    """Seconds since the process started"""
+    try:
+        import psutil
+
+        return time.time() - psutil.Process().create_time()
+    except ImportError:
+        with open("/proc/self/stat") as f:
+            # starttime is field 22; the command name before ")" may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            system_uptime = float(f.read().split()[0])
+        return system_uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def mark(label: str):
+    """Record that a milestone was reached"""
+    _add("at", label, uptime())
+
+
+def record(label: str, seconds: float):
+    """Record how long a step took, if startup is still being reported"""
+    _add("took", label, seconds)
+
+
+@contextmanager
+def timed(label: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(label, time.perf_counter() - started)
+
+
+def finish():
+    """Log the report once; later imports and loads are no longer recorded"""
+    global _finished
+    mark("startup complete")
+    with _lock:
+        _finished = True
+        lines = [
+            f"  {label:<40} {kind:>4} {seconds:8.2f}s"
+            for kind, label, seconds in _timings
+        ]
+    logger.info("Startup timings:\n" + "\n".join(lines))
+
+
+def _add(kind: str, label: str, seconds: float):
+    with _lock:
+        if not _finished:
+            _timings.append((kind, label, seconds))
@@ -59,6 +59,21 @@ class Strings:
         ),
     }
 
+    # Combo mode: several analyses on one photo
+    COMBO_ITEM = ("🧰 Combine Several Analyses", "combo", "Combo Analysis")
+    COMBO_TOGGLE_PREFIX = "combo:"
+    COMBO_RUN_CALLBACK = "combo:run"
+    COMBO_RUN_BUTTON = "▶️ Run Selected"
+    COMBO_SELECTED = "✅ {}"
+    COMBO_SELECTION = "🧰 Pick the analyses to run on your photo, then tap Run."
+    COMBO_EMPTY = "☝️ Select at least one analysis first."
+    COMBO_ALBUM = (
+        "🧰 Combo mode works on one photo at a time. Please send a single photo."
+    )
+
+    # Albums: one result per photo, labelled by position
+    ALBUM_ITEM = "{} #{}"
+
     # ======================
     # System Messages
     # ======================
@@ -69,12 +84,18 @@ class Strings:
         "❌ Operation cancelled.\n\n🤔 What would you like to do next?"
     )
     PROCESSING = "✅ Got it!\n\n⏳ Processing your photo now..."
+    PROCESSING_PARTIAL = "⏳ Still reading, here's what I have so far:\n\n{}"
+    PROCESSING_QUEUED = "\n\n🚶 You're #{} in the queue, about {} to go."
+    RATE_LIMITED = "🐢 You're sending photos faster than I can keep up.\n\n⏳ Please try again in {}."
+    BUSY = "🚦 I'm a bit busy right now.\n\n⏳ Please try again in a moment."
+    TASK_BUSY = "🚦 Too busy right now, please try again later."
 
     TASK_SELECTION = (
         "✅ Task selected: {}.\n\n👇 Now, please send me the photo you want to analyze."
     )
 
     INVALID_TASK_STATE = "👋 Hey there!\n\n🤔 It looks like you sent a photo without selecting a task first.\n\nPlease use /start to choose an option from the menu."
+    FILE_TOO_LARGE = "📦 That file is too big. Please send images up to {} MB."
     FILE_ERROR = "⚠️ A file error occurred 📂, possibly during model loading."
     FILE_OPERATION_ERROR = (
         "⚠️ Failed to perform a file operation 💾 (e.g., save or delete)."
@@ -104,6 +125,12 @@ class Strings:
     NUDITY_DETECTED = "🚫 Detected sensitive content:\n• {}"
     NO_NUDITY = "✅ No sensitive content detected"
 
+    # Combo Results
+    COMBO_TASK_FAILED = "❌ *{}*: {}"
+    COMBO_TEXT_LIMIT = 600
+    CAPTION_LIMIT = 1024
+    MESSAGE_LIMIT = 4096
+
     # Image Segmentation
     SEGMENTATION_SUMMARY = "🔍 Detected {} distinct segments"
 
@@ -113,6 +140,8 @@ class Strings:
     MODEL_INIT_ERROR = "❌ {} model initialization failed 😟"
     PROCESSING_ERROR = "❌ Error processing {} 😥"
     RESULT_FORMAT_ERROR = "❌ Error formatting detection results 💔"
+    NO_WORKER = "❌ No worker is available for {} right now 🔌"
+    JOB_TIMEOUT = "⌛ {} took too long, please try again later."
     OBJECT_DETECTION_LINE = "🔹 {}: {}"
     NO_OBJECTS = "👁️‍🗨️ No objects detected."
     NO_TEXT = "❌📄 No text could be extracted."
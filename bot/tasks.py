@@ -0,0 +1,78 @@
+"""Task dispatch shared by the Telegram front-end and the inference workers"""
+
+import sys
+import time
+import asyncio
+from concurrent.futures import Executor
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, Optional
+from bot import metrics
+from bot.scheduler import BATCHED_TASKS, TASKS
+from models.registry import import_task_module
+
+
+async def run_task(
+    task: str,
+    image,
+    resources: Dict[str, Any],
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> dict:
+    """Run one task on a decoded image.
+
+    ``resources`` is ``bot_data`` in the bot, or the equivalent dict in a
+    worker: it must hold ``config`` and ``model_registry``. Tasks that produce
+    partial results (OCR) pass them to ``progress`` as they go.
+    """
+    with metrics.span("inference", task):
+        return await _dispatch(task, image, resources, executor, progress)
+
+
+async def _dispatch(
+    task: str,
+    image,
+    resources: Dict[str, Any],
+    executor: Optional[Executor],
+    progress: Optional[Callable[[str], Awaitable[None]]],
+) -> dict:
+    if task not in TASKS:
+        raise ValueError(f"Unknown task: {task}")
+    task_config = resources["config"]["models"][task]
+    pipeline = await task_module(task)
+
+    if task == "text_extraction":
+        return await pipeline.process_image(image, task_config, executor, progress)
+
+    # Everything else owns a model that the registry loads on first use
+    async with resources["model_registry"].use(task) as model:
+        return await pipeline.process_image(image, model, task_config, executor)
+
+
+async def task_module(task: str) -> ModuleType:
+    """The task's pipeline module; the first import runs off the event loop"""
+    if module := sys.modules.get(f"models.{task}.{task}"):
+        return module
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, import_task_module, task)
+
+
+async def run_on_pool(
+    task: str,
+    image,
+    resources: Dict[str, Any],
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> dict:
+    """Run a task on its scheduler pool, waiting for a free worker slot.
+
+    Batched tasks skip the slot: their requests queue in the model's batcher,
+    which runs each batch as a single job on the pool's executor. Admission
+    (``reserve``/``release``) still bounds how many of them are in flight.
+    """
+    pool = resources["scheduler"].pool(task)
+    if task in BATCHED_TASKS:
+        return await run_task(task, image, resources, pool.executor, progress)
+
+    queued = time.perf_counter()
+    async with pool.running() as executor:
+        metrics.observe("queue_wait", time.perf_counter() - queued, task)
+        return await run_task(task, image, resources, executor, progress)
@@ -1,95 +1,297 @@
 import os
-import shutil
+import time
+import asyncio
 import logging
-from telegram import Update
+from typing import Optional
+from telegram import InputMediaPhoto, Update
 from telegram.ext import CallbackContext
 from telegram.helpers import escape_markdown
 from bot.strings import Strings
+from models.image_utils import STICKER_NAME
 
 logger = logging.getLogger(__name__)
 
 
-def clean_database(config):
-    db_dir = config["app"]["database_dir"]
-    try:
-        if os.path.exists(db_dir):
-            shutil.rmtree(db_dir)
-        os.makedirs(db_dir, exist_ok=True)
-    except Exception as e:
-        logger.error(f"Database cleanup failed: {e}")
-        raise
+def persist_images(workspace: str, name: str, original: bytes, result: dict):
+    """Debug helper: keep the original upload and the task output on disk"""
+    os.makedirs(workspace, exist_ok=True)
+    with open(os.path.join(workspace, f"original_{name}.jpg"), "wb") as f:
+        f.write(original)
+
+    if image_buffer := result.get("image_buffer"):
+        _, ext = os.path.splitext(getattr(image_buffer, "name", "result.jpg"))
+        with open(os.path.join(workspace, f"result_{name}{ext}"), "wb") as f:
+            f.write(image_buffer.getvalue())
+
+    if text := result.get("text"):
+        with open(
+            os.path.join(workspace, f"extracted_{name}.txt"),
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(text)
+
+
+def select_image_source(message, max_side=None):
+    """The photo size, or the uncompressed image document, to download"""
+    if message.photo:
+        return select_photo_size(message.photo, max_side)
+    return message.document
+
+
+def document_too_large(message, config) -> bool:
+    document = message.document
+    max_bytes = config["app"].get("max_document_mb", 20) * 1024 * 1024
+    return bool(document and document.file_size and document.file_size > max_bytes)
+
+
+def select_photo_size(photos, max_side=None):
+    """Pick the smallest Telegram PhotoSize that still covers the model's input size"""
+    if not max_side:
+        return photos[-1]
+    for photo in sorted(photos, key=lambda p: p.width * p.height):
+        if max(photo.width, photo.height) >= max_side:
+            return photo
+    return photos[-1]
 
 
-def create_image_folder(image_id: str, config) -> str:
-    db_dir = config["app"]["database_dir"]
-    image_folder = os.path.join(db_dir, image_id)
-    os.makedirs(image_folder, exist_ok=True)
-    return image_folder
+def format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(1, round(seconds))}s"
+    return f"{round(seconds / 60)} min"
+
+
+def processing_message(pools, owner=None) -> str:
+    """The ack text, with queue position and expected wait if the request must queue"""
+    position, wait = max(
+        (pool.estimate(owner) for pool in pools), key=lambda e: e[1], default=(0, 0)
+    )
+    if not position:
+        return Strings.PROCESSING
+    return Strings.PROCESSING + Strings.PROCESSING_QUEUED.format(
+        position, format_wait(wait)
+    )
+
+
+def in_background(context: CallbackContext, coroutine, what: str):
+    """Run a Bot API call nobody needs to wait for; a failure is only logged"""
+
+    async def run():
+        try:
+            await coroutine
+        except Exception as e:
+            logger.warning(f"{what} failed: {e}")
+
+    return context.application.create_task(run())
 
 
 async def delete_prev_messages(update: Update, context: CallbackContext):
-    try:
-        if prev_msg_id := context.user_data.get("prev_message"):
-            await context.bot.delete_message(
+    """Forget the previous bot message and delete it in the background"""
+    if prev_msg_id := context.user_data.get("prev_message"):
+        context.user_data["prev_message"] = None
+        in_background(
+            context,
+            context.bot.delete_message(
                 chat_id=update.effective_chat.id, message_id=prev_msg_id
+            ),
+            "Message deletion",
+        )
+
+
+def format_processed_caption(result: dict, task_name: str) -> str:
+    safe_task = escape_markdown(task_name, version=2)
+    safe_model = escape_markdown(result.get("model_name", "Unknown"), version=2)
+
+    caption = Strings.RESULT_HEADER.format(safe_task)
+    caption += Strings.MODEL_INFO.format(safe_model)
+
+    if "detection_summary" in result:
+        safe_summary = escape_markdown(result["detection_summary"], version=2)
+        caption += f"\n\n{safe_summary}"
+
+    if "speed_summary" in result:
+        safe_speed = escape_markdown(result["speed_summary"], version=2)
+        caption += f"\n\n{safe_speed}"
+
+    return caption
+
+
+def format_emotion_message(result: dict, task_name: str) -> str:
+    safe_task = escape_markdown(task_name, version=2)
+    faces = result["faces_detected"]
+    message = Strings.EMOTION_HEADER.format(safe_task)
+
+    if faces == 0:
+        message += "No faces detected in the image"
+    else:
+        message += Strings.FACES_DETECTED.format(faces, "" if faces == 1 else "s")
+
+        for idx, emotion in enumerate(result["emotions"], 1):
+            scores = "\n".join(f"{k}: {v:.1f}%" for k, v in emotion["scores"].items())
+            message += Strings.EMOTION_FORMAT.format(
+                idx,
+                escape_markdown(emotion["dominant"], version=2),
+                escape_markdown(scores, version=2),
             )
-            context.user_data["prev_message"] = None
-    except Exception as e:
-        logger.warning(f"Message deletion failed: {e}")
 
+    return message
+
+
+def format_text_message(result: dict, task_name: str, max_chars: int = 0) -> str:
+    text = result.get("text") or Strings.NO_TEXT
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars] + "\n... (truncated)"
+    safe_text = escape_markdown(text, version=2)
+    safe_task = escape_markdown(task_name, version=2)
+    safe_model = escape_markdown(result.get("model_name", "Unknown"), version=2)
+
+    return Strings.TEXT_RESULT.format(safe_task, safe_model, safe_text)
+
+
+def progress_editor(message, interval: float):
+    """Progress callback that shows partial text by editing ``message``.
+
+    Edits are at most ``interval`` seconds apart to stay under Telegram's
+    rate limits; only the tail of long text is shown.
+    """
+    last_edit = 0.0
+
+    async def progress(text: str):
+        nonlocal last_edit
+        if not text or time.monotonic() - last_edit < interval:
+            return
+        last_edit = time.monotonic()
+
+        limit = Strings.MESSAGE_LIMIT - len(Strings.PROCESSING_PARTIAL)
+        try:
+            await message.edit_text(Strings.PROCESSING_PARTIAL.format(text[-limit:]))
+        except Exception as e:
+            logger.warning(f"Progress update failed: {e}")
+
+    return progress
 
-async def send_processed_result(update: Update, result: dict, task_name: str):
-    try:
-        safe_task = escape_markdown(task_name, version=2)
-        safe_model = escape_markdown(result.get("model_name", "Unknown"), version=2)
 
-        base_caption = Strings.RESULT_HEADER.format(safe_task)
-        base_caption += Strings.MODEL_INFO.format(safe_model)
+def is_sticker(result: dict) -> bool:
+    return getattr(result.get("image_buffer"), "name", None) == STICKER_NAME
 
-        if "detection_summary" in result:
-            safe_summary = escape_markdown(result["detection_summary"], version=2)
-            base_caption += f"\n\n{safe_summary}"
 
-        if "speed_summary" in result:
-            safe_speed = escape_markdown(result["speed_summary"], version=2)
-            base_caption += f"\n\n{safe_speed}"
+async def known_file_id(
+    result: dict, file_ids=None, kind: str = "photo"
+) -> Optional[str]:
+    """A Telegram file id that already holds this result's image, if any.
+
+    The store hashes the image and may hit SQLite, so it runs off the event loop.
+    """
+    if kind == "photo" and (file_id := result.get("file_id")):
+        return file_id
+    if file_ids is not None and (image_buffer := result.get("image_buffer")):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, file_ids.get, image_buffer.getvalue(), kind
+        )
+    return None
+
+
+async def remember_upload(result: dict, message, file_ids=None):
+    if (
+        file_ids is None
+        or not message
+        or not (image_buffer := result.get("image_buffer"))
+    ):
+        return
+    if message.photo:
+        file_id, kind = message.photo[-1].file_id, "photo"
+    elif message.sticker:
+        file_id, kind = message.sticker.file_id, "sticker"
+    else:
+        return
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(
+        None, file_ids.put, image_buffer.getvalue(), file_id, kind
+    )
+
+
+async def forget_file_id(result: dict, file_ids=None, kind: str = "photo"):
+    """Drop a file id Telegram rejected, off the event loop"""
+    if file_ids is None or not (image_buffer := result.get("image_buffer")):
+        return
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, file_ids.discard, image_buffer.getvalue(), kind)
+
+
+async def send_processed_result(
+    update: Update, result: dict, task_name: str, file_ids=None
+):
+    try:
+        base_caption = format_processed_caption(result, task_name)
 
         # Add bot ID suffix
         base_caption += Strings.BOT_ID_SUFFIX.format(Strings.BOT_ID)
 
-        with open(result["image_path"], "rb") as photo_file:
-            await update.message.reply_photo(
-                photo=photo_file,
-                caption=base_caption,
-                parse_mode="MarkdownV2",
-                reply_to_message_id=update.message.message_id,
-            )
+        if is_sticker(result):
+            return await send_sticker_result(update, result, base_caption, file_ids)
+
+        if file_id := await known_file_id(result, file_ids):
+            try:
+                # Already uploaded once: reference it instead of sending the bytes again
+                return await update.message.reply_photo(
+                    photo=file_id,
+                    caption=base_caption,
+                    parse_mode="MarkdownV2",
+                    reply_to_message_id=update.message.message_id,
+                )
+            except Exception as e:
+                logger.warning(f"Cached file_id rejected, re-uploading: {e}")
+                await forget_file_id(result, file_ids)
+
+        image_buffer = result["image_buffer"]
+        image_buffer.seek(0)
+        message = await update.message.reply_photo(
+            photo=image_buffer,
+            caption=base_caption,
+            parse_mode="MarkdownV2",
+            reply_to_message_id=update.message.message_id,
+        )
+        await remember_upload(result, message, file_ids)
+        return message
 
     except Exception as e:
         logger.error(f"Failed to send result: {e}")
         await update.message.reply_text(Strings.GENERIC_ERROR)
 
 
-async def send_emotion_result(update: Update, result: dict, task_name: str):
-    try:
-        safe_task = escape_markdown(task_name, version=2)
-        faces = result["faces_detected"]
-        base_msg = Strings.EMOTION_HEADER.format(safe_task)
+async def send_sticker_result(
+    update: Update, result: dict, caption: str, file_ids=None
+):
+    """Reply with the result as a sticker; stickers take no caption, so it follows"""
+    image_buffer = result["image_buffer"]
+    sticker = await known_file_id(result, file_ids, "sticker")
+    message = None
+    if sticker is not None:
+        try:
+            message = await update.message.reply_sticker(
+                sticker=sticker, reply_to_message_id=update.message.message_id
+            )
+        except Exception as e:
+            logger.warning(f"Cached sticker file_id rejected, re-uploading: {e}")
+            await forget_file_id(result, file_ids, "sticker")
+
+    if message is None:
+        image_buffer.seek(0)
+        message = await update.message.reply_sticker(
+            sticker=image_buffer, reply_to_message_id=update.message.message_id
+        )
+        await remember_upload(result, message, file_ids)
 
-        if faces == 0:
-            base_msg += "No faces detected in the image"
-        else:
-            base_msg += Strings.FACES_DETECTED.format(faces, "" if faces == 1 else "s")
+    await update.message.reply_text(
+        caption, parse_mode="MarkdownV2", reply_to_message_id=message.message_id
+    )
+    return message
 
-            for idx, emotion in enumerate(result["emotions"], 1):
-                scores = "\n".join(
-                    f"{k}: {v:.1f}%" for k, v in emotion["scores"].items()
-                )
-                base_msg += Strings.EMOTION_FORMAT.format(
-                    idx,
-                    escape_markdown(emotion["dominant"], version=2),
-                    escape_markdown(scores, version=2),
-                )
+
+async def send_emotion_result(update: Update, result: dict, task_name: str):
+    try:
+        base_msg = format_emotion_message(result, task_name)
 
         # Add bot ID suffix
         base_msg += Strings.BOT_ID_SUFFIX.format(Strings.BOT_ID)
@@ -107,12 +309,7 @@ async def send_emotion_result(update: Update, result: dict, task_name: str):
 
 async def send_text_result(update: Update, result: dict, task_name: str):
     try:
-        text = result.get("text", Strings.NO_TEXT)
-        safe_text = escape_markdown(text, version=2)
-        safe_task = escape_markdown(task_name, version=2)
-        safe_model = escape_markdown(result.get("model_name", "Unknown"), version=2)
-
-        message = Strings.TEXT_RESULT.format(safe_task, safe_model, safe_text)
+        message = format_text_message(result, task_name)
 
         if len(message) > 4096:
             message = message[:4000] + "\n... (truncated)"
@@ -131,23 +328,154 @@ async def send_text_result(update: Update, result: dict, task_name: str):
         await update.message.reply_text(Strings.GENERIC_ERROR)
 
 
+async def send_result_group(update: Update, outcomes: list, file_ids=None) -> list:
+    """Send several results as one media group plus one combined caption.
+
+    ``outcomes`` holds ``(key, task, task_name, result)`` tuples where a failed
+    result is the error message to show. Returns ``(key, message)`` pairs for
+    every uploaded image so callers can record their file ids.
+    """
+    sections = []
+    images = []
+    for key, task, task_name, result in outcomes:
+        if isinstance(result, str):
+            sections.append(
+                Strings.COMBO_TASK_FAILED.format(
+                    escape_markdown(task_name, version=2),
+                    escape_markdown(result, version=2),
+                )
+            )
+        elif task == "text_extraction":
+            sections.append(
+                format_text_message(result, task_name, Strings.COMBO_TEXT_LIMIT)
+            )
+        elif task == "emotion_recognition":
+            sections.append(format_emotion_message(result, task_name))
+        else:
+            sections.append(format_processed_caption(result, task_name))
+            images.append((key, result))
+
+    caption = "\n\n".join(sections) + Strings.BOT_ID_SUFFIX.format(Strings.BOT_ID)
+    reply_to = update.message.message_id
+    attach_caption = len(caption) <= Strings.CAPTION_LIMIT
+
+    known = {key: await known_file_id(result, file_ids) for key, result in images}
+    group_caption = caption if attach_caption else None
+
+    sent = []
+    if len(images) == 1:
+        key, result = images[0]
+        message = None
+        if known[key]:
+            try:
+                message = await update.message.reply_photo(
+                    photo=known[key],
+                    caption=group_caption,
+                    parse_mode="MarkdownV2",
+                    reply_to_message_id=reply_to,
+                )
+            except Exception as e:
+                logger.warning(f"Cached file_id rejected, re-uploading: {e}")
+                known[key] = None
+        if message is None:
+            image_buffer = result["image_buffer"]
+            image_buffer.seek(0)
+            message = await update.message.reply_photo(
+                photo=image_buffer,
+                caption=group_caption,
+                parse_mode="MarkdownV2",
+                reply_to_message_id=reply_to,
+            )
+        sent = [(key, message)]
+    elif images:
+        try:
+            messages = await update.message.reply_media_group(
+                _media_group(images, group_caption, known),
+                reply_to_message_id=reply_to,
+            )
+        except Exception as e:
+            logger.warning(
+                f"Media group with cached file ids failed, re-uploading: {e}"
+            )
+            known = {}
+            messages = await update.message.reply_media_group(
+                _media_group(images, group_caption, known),
+                reply_to_message_id=reply_to,
+            )
+        sent = [(key, message) for (key, _), message in zip(images, messages)]
+
+    results = dict(images)
+    for key, message in sent:
+        if not known.get(key):
+            await remember_upload(results[key], message, file_ids)
+
+    if not images or not attach_caption:
+        for chunk in _chunk_sections(sections):
+            await update.message.reply_text(
+                chunk, parse_mode="MarkdownV2", reply_to_message_id=reply_to
+            )
+
+    return sent
+
+
+def _media_group(images: list, caption, known_file_ids: dict) -> list:
+    media = []
+    for index, (key, result) in enumerate(images):
+        source = known_file_ids.get(key)
+        if source is None:
+            source = result["image_buffer"]
+            source.seek(0)
+        media.append(
+            InputMediaPhoto(
+                media=source,
+                caption=caption if index == 0 else None,
+                parse_mode="MarkdownV2" if index == 0 and caption else None,
+            )
+        )
+    return media
+
+
+def _chunk_sections(sections: list) -> list:
+    suffix = Strings.BOT_ID_SUFFIX.format(Strings.BOT_ID)
+    chunks, current = [], ""
+    for section in sections:
+        section = _truncate_markdown(section, Strings.MESSAGE_LIMIT - len(suffix))
+        candidate = f"{current}\n\n{section}" if current else section
+        if len(candidate) + len(suffix) > Strings.MESSAGE_LIMIT:
+            chunks.append(current)
+            candidate = section
+        current = candidate
+    chunks.append(current)
+    chunks[-1] += suffix
+    return chunks
+
+
+def _truncate_markdown(text: str, limit: int) -> str:
+    """Cut MarkdownV2 ``text`` to at most ``limit`` characters, keeping it valid.
+
+    The cut moves back to a line break, since escapes and inline entities never
+    span lines, and a code block left open by the cut is closed again.
+    """
+    if len(text) <= limit:
+        return text
+    fence = "\n```"
+    cut = text[: limit - len(fence)]
+    if (newline := cut.rfind("\n")) > 0:
+        cut = cut[:newline]
+    # An odd run of trailing backslashes is an escape cut off from its character
+    if (len(cut) - len(cut.rstrip("\\"))) % 2:
+        cut = cut[:-1]
+    if cut.count("```") % 2:
+        cut += fence
+    return cut
+
+
 async def cleanup_operation(update: Update, context: CallbackContext):
     try:
         await delete_prev_messages(update, context)
 
-        image_id = context.user_data.pop("image_id", None)
-        if image_id:
-            config = context.bot_data["config"]
-            db_dir = config["app"]["database_dir"]
-            image_folder = os.path.join(db_dir, image_id)
-            if os.path.exists(image_folder):
-                try:
-                    shutil.rmtree(image_folder)
-                    logger.info(f"Deleted image folder: {image_folder}")
-                except Exception as e:
-                    logger.error(f"Error deleting image folder: {e}")
-
         context.user_data.pop("task", None)
         context.user_data.pop("task_message", None)
+        context.user_data.pop("combo_tasks", None)
     except Exception as e:
         logger.error(f"Cleanup error: {e}")
@@ -0,0 +1,127 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def workspace_dir(config: Dict[str, Any], chat_id: int, message_id: int) -> str:
+    """A request's folder under ``database_dir``.
+
+    Message ids are only unique within a chat, so the chat id is part of the path.
+    """
+    return os.path.join(config["app"]["database_dir"], str(chat_id), str(message_id))
+
+
+class Janitor:
+    """Reclaims request workspaces in the background.
+
+    Folders older than ``max_age_hours`` are deleted, then the oldest ones
+    until the total fits ``max_mb``. The scan and the deletes run on an
+    executor thread, so a large ``database_dir`` never blocks the bot.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        janitor_config = config["app"].get("janitor", {})
+        self.root = config["app"]["database_dir"]
+        self.max_age = janitor_config.get("max_age_hours", 24) * 3600
+        self.max_bytes = janitor_config.get("max_mb", 0) * 2**20
+        self.interval = janitor_config.get("interval_seconds", 600)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                removed, freed = await loop.run_in_executor(None, self.sweep)
+                if removed:
+                    logger.info(
+                        f"Janitor removed {removed} workspaces "
+                        f"({freed / 2**20:.1f} MB)"
+                    )
+            except Exception as e:
+                logger.error(f"Workspace cleanup failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def sweep(self) -> Tuple[int, int]:
+        """Delete expired and over-budget workspaces; returns (count, bytes)"""
+        workspaces = sorted(self._workspaces())
+        now = time.time()
+        total = sum(size for _, size, _ in workspaces)
+        removed = freed = 0
+
+        for modified, size, path in workspaces:
+            expired = self.max_age and now - modified > self.max_age
+            over_budget = self.max_bytes and total > self.max_bytes
+            if not (expired or over_budget):
+                # Sorted oldest first: nothing newer is expired either
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+            freed += size
+
+        self._remove_empty_chats()
+        return removed, freed
+
+    def _workspaces(self) -> List[Tuple[float, int, str]]:
+        workspaces = []
+        for chat in _subdirs(self.root):
+            if _has_files(chat.path):
+                # Flat <database_dir>/<message_id> folder from before per-chat workspaces
+                workspaces.append((*_measure(chat.path), chat.path))
+                continue
+            for workspace in _subdirs(chat.path):
+                workspaces.append((*_measure(workspace.path), workspace.path))
+        return workspaces
+
+    def _remove_empty_chats(self):
+        for chat in _subdirs(self.root):
+            try:
+                os.rmdir(chat.path)
+            except OSError:
+                pass
+
+
+def _measure(path: str) -> Tuple[float, int]:
+    """Last modification time and total size of a folder's files"""
+    modified, size = os.stat(path).st_mtime, 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            modified = max(modified, stat.st_mtime)
+    return modified, size
+
+
+def _has_files(path: str) -> bool:
+    with os.scandir(path) as entries:
+        return any(entry.is_file(follow_symlinks=False) for entry in entries)
+
+
+def _subdirs(path: str) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return []
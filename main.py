@@ -1,12 +1,18 @@
 import os
+import asyncio
 import logging
 import yaml
 from dotenv import load_dotenv
 from telegram.ext import Application
-from bot import handlers, utils
-from models.object_detection import object_detection
-from models.nudity_detection import nudity_detection
-from models.image_segmentation import image_segmentation
+from telegram.request import HTTPXRequest
+from bot import handlers, metrics, startup
+from bot.cache import ResultCache
+from bot.file_ids import FileIdStore
+from bot.jobs import create_backend
+from bot.limits import RateLimiter
+from bot.scheduler import Scheduler
+from bot.workspaces import Janitor
+from models.registry import build_registry
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -21,6 +27,7 @@ def load_config(config_path="config.yaml"):
 
 
 def main():
+    startup.mark("imports done")
     try:
         load_dotenv()
         TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -30,46 +37,142 @@ def main():
 
         config = load_config()
 
-        utils.clean_database(config)
-
-        object_model_data = object_detection.initialize_model(
-            config["models"]["object_detection"]
-        )
-        nudity_detector = (
-            nudity_detection.initialize_detector()
-        )  # NudeDetector init doesn't take config directly
-        segmentation_model = image_segmentation.initialize_model(
-            config["models"]["image_segmentation"]
-        )
-
-        app = (
-            Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+        app_config = config["app"]
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(app_config.get("concurrent_updates", True))
+            .request(build_request(app_config.get("http", {})))
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
         )
+        if base_url := app_config.get("bot_api_base_url"):
+            # e.g. a local Bot API server or tools/fake_telegram.py
+            builder = builder.base_url(base_url)
+            if base_file_url := app_config.get("bot_api_base_file_url"):
+                builder = builder.base_file_url(base_file_url)
+        app = builder.build()
+        startup.mark("application built")
 
         app.bot_data.update(
             {
                 "config": config,
-                "object_detection_model_data": object_model_data,
-                "nudity_detection_detector": nudity_detector,
-                "image_segmentation_model": segmentation_model,
+                "scheduler": Scheduler(config),
+                "result_cache": ResultCache(config),
+                "file_ids": FileIdStore(config),
+                "rate_limiter": RateLimiter(config),
+                "model_registry": build_registry(config),
             }
         )
+        app.bot_data["jobs"] = create_backend(config, app.bot_data)
 
         handlers.register_handlers(app)
+        metrics.configure(config)
 
-        logger.info("Starting bot in polling mode...")
-        app.run_polling(drop_pending_updates=config["app"]["drop_pending_updates"])
+        if app_config.get("mode", "polling") == "webhook":
+            run_webhook(app, app_config)
+        else:
+            logger.info("Starting bot in polling mode...")
+            app.run_polling(drop_pending_updates=app_config["drop_pending_updates"])
 
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
         raise
 
 
+def build_request(http_config) -> HTTPXRequest:
+    """Connection pool for the Bot API calls made while handling updates.
+
+    Polling's getUpdates keeps its own single connection.
+    """
+    return HTTPXRequest(
+        connection_pool_size=http_config.get("connection_pool_size", 64),
+        connect_timeout=http_config.get("connect_timeout", 5),
+        read_timeout=http_config.get("read_timeout", 10),
+        write_timeout=http_config.get("write_timeout", 10),
+        media_write_timeout=http_config.get("media_write_timeout", 60),
+        pool_timeout=http_config.get("pool_timeout", 5),
+        http_version=str(http_config.get("http_version", "1.1")),
+    )
+
+
+def run_webhook(app: Application, app_config):
+    webhook = app_config["webhook"]
+    secret_token = webhook.get("secret_token") or os.getenv("TELEGRAM_WEBHOOK_SECRET")
+
+    logger.info(
+        f"Starting bot in webhook mode on {webhook['listen']}:{webhook['port']}..."
+    )
+    app.run_webhook(
+        listen=webhook["listen"],
+        port=webhook["port"],
+        url_path=webhook.get("url_path", ""),
+        webhook_url=webhook["webhook_url"],
+        secret_token=secret_token,
+        cert=webhook.get("cert"),
+        key=webhook.get("key"),
+        max_connections=webhook.get("max_connections", 40),
+        drop_pending_updates=app_config["drop_pending_updates"],
+    )
+
+
 async def post_init(app: Application):
     from bot.strings import Strings
 
     await app.bot.set_my_commands(Strings.COMMANDS)
 
+    metrics_config = app.bot_data["config"].get("metrics", {})
+    if metrics_config.get("enabled", False):
+        metrics.REGISTRY.add_collector(lambda: collect_metrics(app.bot_data))
+        app.bot_data["metrics_server"] = metrics.start_server(
+            metrics_config.get("host", "127.0.0.1"), metrics_config.get("port", 9464)
+        )
+
+    # Answer /start and the menus right away; models warm up in the background
+    # and requests that need one meanwhile wait for its load
+    app.bot_data["janitor"] = Janitor(app.bot_data["config"])
+    app.bot_data["janitor"].start()
+
+    registry = app.bot_data["model_registry"]
+    registry.start()
+    app.bot_data["warm_up"] = asyncio.get_event_loop().create_task(warm_up(registry))
+    startup.mark("ready for updates")
+
+
+async def warm_up(registry):
+    with startup.timed("model warm-up"):
+        await registry.warm_up()
+    startup.finish()
+
+
+def collect_metrics(bot_data):
+    for task, pool in bot_data["scheduler"].pools.items():
+        metrics.SCHEDULER_PENDING.set(pool.pending, task=task)
+        metrics.SCHEDULER_CAPACITY.set(pool.capacity, task=task)
+        metrics.SCHEDULER_WAITING.set(pool.waiting, task=task)
+
+    cache_stats = bot_data["result_cache"].stats()
+    metrics.CACHE_LOOKUPS.set(cache_stats["hits"], result="hit")
+    metrics.CACHE_LOOKUPS.set(cache_stats["misses"], result="miss")
+    metrics.CACHE_ENTRIES.set(cache_stats["entries"])
+    metrics.CACHE_BYTES.set(cache_stats["bytes"])
+
+    file_id_stats = bot_data["file_ids"].stats()
+    metrics.FILE_ID_LOOKUPS.set(file_id_stats["hits"], result="hit")
+    metrics.FILE_ID_LOOKUPS.set(file_id_stats["misses"], result="miss")
+
+
+async def post_shutdown(app: Application):
+    if (warming := app.bot_data.get("warm_up")) and not warming.done():
+        warming.cancel()
+    if janitor := app.bot_data.get("janitor"):
+        await janitor.close()
+    if server := app.bot_data.get("metrics_server"):
+        server.shutdown()
+    await app.bot_data["jobs"].close()
+    await app.bot_data["model_registry"].close()
+    app.bot_data["scheduler"].shutdown()
+
 
 if __name__ == "__main__":
     main()
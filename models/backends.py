@@ -0,0 +1,66 @@
+import logging
+from typing import Any, Dict, Optional
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torchscript", "onnxruntime", "openvino")
+
+
+def resolve_device(preferred: Optional[str]) -> str:
+    """Use the preferred device when it exists, falling back to CPU without CUDA"""
+    if not preferred:
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if preferred.startswith("cuda") and not torch.cuda.is_available():
+        logger.warning(f"{preferred} requested but CUDA is unavailable, using CPU")
+        return "cpu"
+    return preferred
+
+
+def resolve_backend(config: Dict[str, Any], device: str) -> str:
+    backend = config.get("backend", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "openvino" and device.startswith("cuda"):
+        logger.warning("OpenVINO backend runs on CPU, ignoring CUDA device")
+    return backend
+
+
+def configure_torch_threads(threads: Dict[str, Any]):
+    # torch thread pools are process-wide; the last model to load wins
+    if intra_op := threads.get("intra_op"):
+        torch.set_num_threads(int(intra_op))
+    if inter_op := threads.get("inter_op"):
+        try:
+            torch.set_num_interop_threads(int(inter_op))
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work has started
+            logger.debug("torch inter-op threads already configured")
+
+
+def onnxruntime_session(path: str, threads: Dict[str, Any], device: str = "cpu"):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if intra_op := threads.get("intra_op"):
+        options.intra_op_num_threads = int(intra_op)
+    if inter_op := threads.get("inter_op"):
+        options.inter_op_num_threads = int(inter_op)
+
+    providers = ["CPUExecutionProvider"]
+    if device.startswith("cuda"):
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
+def openvino_compile(path: str, threads: Dict[str, Any]):
+    import openvino as ov
+
+    properties = {}
+    if intra_op := threads.get("intra_op"):
+        properties["INFERENCE_NUM_THREADS"] = int(intra_op)
+    if inter_op := threads.get("inter_op"):
+        properties["NUM_STREAMS"] = int(inter_op)
+
+    core = ov.Core()
+    return core.compile_model(core.read_model(path), "CPU", properties)
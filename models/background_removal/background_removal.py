@@ -1,34 +1,113 @@
+import io
+import queue
 import asyncio
-from pathlib import Path
-from PIL import Image
+import contextvars
+import cv2
+import numpy as np
+import onnxruntime as ort
+from contextlib import contextmanager
+from concurrent.futures import Executor
 from rembg import remove
-from typing import Dict, Any
+from rembg.sessions import sessions_class
+from typing import Dict, Any, Optional
 from bot.strings import Strings
+from models.image_utils import downscale, encode_result
+
+SUPPORTED_MODELS = ("u2net", "u2netp", "isnet-general-use", "silueta")
+
+
+class SessionPool:
+    """Pre-warmed rembg sessions leased to one request at a time"""
+
+    def __init__(self, sessions: list, model_name: str):
+        self.model_name = model_name
+        self.size = len(sessions)
+        self._sessions = queue.Queue()
+        for session in sessions:
+            self._sessions.put(session)
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        session = self._sessions.get(timeout=timeout)
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+
+def initialize_model(config: Dict[str, Any]) -> SessionPool:
+    try:
+        model_name = config.get("model_name", "u2net")
+        if model_name not in SUPPORTED_MODELS:
+            raise ValueError(f"Unsupported rembg model: {model_name}")
+
+        sessions = [
+            _new_session(model_name, config.get("onnx_threads"))
+            for _ in range(max(1, config.get("pool_size", 1)))
+        ]
+
+        # Run each session once so the first user request doesn't pay for it
+        warmup_image = np.zeros((64, 64, 3), dtype=np.uint8)
+        for session in sessions:
+            remove(warmup_image, session=session)
+
+        return SessionPool(sessions, model_name)
+    except Exception as e:
+        raise RuntimeError(Strings.MODEL_INIT_ERROR.format("background removal")) from e
+
+
+def _new_session(model_name: str, onnx_threads: Optional[int]):
+    # Sized per session, so several pooled sessions don't each take every core
+    sess_opts = ort.SessionOptions()
+    if onnx_threads:
+        sess_opts.intra_op_num_threads = onnx_threads
+        sess_opts.inter_op_num_threads = onnx_threads
+    # Built directly: older rembg releases' new_session passes its own options
+    # positionally, so it can't take ours
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            return session_class(model_name, sess_opts)
+    raise ValueError(f"Unsupported rembg model: {model_name}")
 
 
 async def process_image(
-    original_path: str, output_folder: str, image_id: str
+    image: np.ndarray,
+    session_pool: SessionPool,
+    config: Dict[str, Any],
+    executor: Optional[Executor] = None,
 ) -> Dict[str, Any]:
     try:
-        bgremoval_folder = Path(output_folder) / "background_removal"
-        bgremoval_folder.mkdir(exist_ok=True)
-        output_path = bgremoval_folder / f"nobg_{image_id}.png"
-
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, lambda: _remove_bg(original_path, output_path))
+        image_buffer = await loop.run_in_executor(
+            executor,
+            # In the request's context, so the encode span keeps its task and id
+            contextvars.copy_context().run,
+            lambda: _remove_bg(image, session_pool, config),
+        )
 
         return {
-            "image_path": str(output_path),
+            "image_buffer": image_buffer,
             "model_name": Strings.MODEL_NAMES["background_removal"],
         }
     except Exception as e:
         raise RuntimeError(Strings.PROCESSING_ERROR.format("background removal")) from e
 
 
-def _remove_bg(input_path: str, output_path: Path):
-    try:
-        with Image.open(input_path) as img:
-            output = remove(img)
-            output.save(output_path, "PNG")
-    except IOError:
-        raise ValueError(Strings.INVALID_IMAGE)
+def _remove_bg(
+    image: np.ndarray, session_pool: SessionPool, config: Dict[str, Any]
+) -> io.BytesIO:
+    model_input, _ = downscale(image, config.get("max_input_side"))
+    with session_pool.lease(timeout=config.get("lease_timeout")) as session:
+        mask = remove(
+            cv2.cvtColor(model_input, cv2.COLOR_BGR2RGB),
+            session=session,
+            only_mask=True,
+        )
+
+    # Predict the alpha mask at model resolution, apply it to the full-size photo
+    height, width = image.shape[:2]
+    if mask.shape[:2] != (height, width):
+        mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR)
+    output = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    output[..., 3] = mask
+    return encode_result(output, config.get("encoding"), "png")
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+import contextvars
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+from bot import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Gathers concurrent requests and runs them through a single batched call.
+
+    ``batch_fn`` receives a list of inputs and must return a list of outputs in
+    the same order. It runs in an executor so the event loop stays responsive.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 20.0,
+        name: str = "batcher",
+        metrics_log_interval: int = 0,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self.metrics_log_interval = metrics_log_interval
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = None
+
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+        self.max_queue_depth = 0
+
+    async def submit(self, item: Any, executor=None) -> Any:
+        self._ensure_worker()
+        if executor is not None:
+            self._executor = executor
+
+        future = asyncio.get_running_loop().create_future()
+        # The request's context, so its queue wait is logged under its request id
+        await self._queue.put(
+            (item, future, time.perf_counter(), contextvars.copy_context())
+        )
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_wait_ms": (
+                self.total_wait / self.items * 1000 if self.items else 0.0
+            ),
+            "max_queue_wait_ms": self.max_wait_seen * 1000,
+        }
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._queue = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[tuple]):
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        for _, _, enqueued, context in batch:
+            wait = started - enqueued
+            self.total_wait += wait
+            self.max_wait_seen = max(self.max_wait_seen, wait)
+            # Batched requests skip the pool's slot queue; this is their queue wait
+            context.run(metrics.observe, "queue_wait", wait, self.name)
+        metrics.BATCH_SIZE.observe(len(batch), task=self.name)
+
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] += 1
+
+        try:
+            inputs = [item for item, _, _, _ in batch]
+            outputs = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.batch_fn, inputs
+            )
+            if len(outputs) != len(batch):
+                raise RuntimeError(
+                    f"{self.name}: batch returned {len(outputs)} results for {len(batch)} inputs"
+                )
+            for (_, future, _, _), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
+        except Exception as e:
+            for _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+        logger.debug(
+            f"{self.name}: ran batch of {len(batch)} in "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms "
+            f"(queue depth {self.queue_depth()})"
+        )
+        if self.metrics_log_interval and self.batches % self.metrics_log_interval == 0:
+            logger.info(f"{self.name} metrics: {self.stats()}")
@@ -1,55 +1,171 @@
+import time
 import asyncio
-from pathlib import Path
-from typing import Dict, Any
+import logging
+import numpy as np
+from functools import partial
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional
 from deepface import DeepFace
+from deepface.modules.preprocessing import resize_image
+from bot import metrics
 from bot.strings import Strings
+from models.batching import MicroBatcher
+from models.image_utils import downscale
+
+logger = logging.getLogger(__name__)
+
+# Output order of DeepFace's emotion classifier
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+# Face crops are padded and resized to this before the client's own 48x48 grayscale step
+FACE_INPUT_SIZE = (224, 224)
+
+
+def initialize_model(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the emotion classifier and the face detector up front.
+
+    DeepFace would otherwise build both inside the first request. Face crops
+    are classified through a batcher, so every face of every photo that
+    arrives together goes through one classifier call.
+    """
+    try:
+        backend = config["emotion_detector_backend"]
+        started = time.perf_counter()
+        client = DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+
+        # DeepFace caches the detector once built, so a blank frame warms it up
+        _detect_faces(
+            np.zeros((64, 64, 3), dtype=np.uint8),
+            {**config, "emotion_enforce_detection": False},
+        )
+        logger.info(
+            f"DeepFace emotion model and {backend} face detector built in "
+            f"{time.perf_counter() - started:.1f}s"
+        )
+
+        model_data = {"client": client, "detector_backend": backend}
+        batching = config.get("batching", {})
+        model_data["batcher"] = MicroBatcher(
+            partial(_classify_batch, model_data),
+            max_batch_size=batching.get("max_batch_size", 10),
+            max_wait_ms=batching.get("max_wait_ms", 20),
+            name="emotion_recognition",
+            metrics_log_interval=batching.get("metrics_log_interval", 0),
+        )
+        return model_data
+    except Exception as e:
+        raise RuntimeError(
+            Strings.MODEL_INIT_ERROR.format("emotion recognition")
+        ) from e
 
 
 async def process_image(
-    original_path: str, output_folder: str, image_id: str, config: Dict[str, Any]
+    image: np.ndarray,
+    model_data: Dict[str, Any],
+    config: Dict[str, Any],
+    executor: Optional[Executor] = None,
 ) -> Dict[str, Any]:
     try:
-        emotion_folder = Path(output_folder) / "emotion_recognition"
-        emotion_folder.mkdir(exist_ok=True)
-
         loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(
-            None,
-            lambda: DeepFace.analyze(
-                img_path=original_path,
-                actions=config["emotion_actions"],
-                detector_backend=config["emotion_detector_backend"],
-                enforce_detection=config["emotion_enforce_detection"],
-                silent=config["emotion_silent"],
-            ),
+        model_input, scale = await loop.run_in_executor(
+            executor, downscale, image, config.get("max_input_side")
         )
+        faces = await loop.run_in_executor(executor, _detect_faces, model_input, config)
+
+        scores = []
+        if faces:
+            scores = await model_data["batcher"].submit(
+                [face["input"] for face in faces], executor
+            )
 
         emotions = []
-        for face in results:
+        for face, face_scores in zip(faces, scores):
             emotions.append(
                 {
-                    "dominant": face["dominant_emotion"],
-                    "scores": face["emotion"],
-                    "region": face["region"],
+                    "dominant": max(face_scores, key=face_scores.get),
+                    "scores": face_scores,
+                    "region": _scale_region(face["region"], scale),
                 }
             )
 
         return {
             "emotions": emotions,
             "model_name": Strings.MODEL_NAMES["emotion_recognition"],
-            "faces_detected": len(results),
+            "faces_detected": len(emotions),
         }
-    except ValueError as e:
-        if "No face detected" in str(e):
-            return {
-                "emotions": [],
-                "model_name": Strings.MODEL_NAMES["emotion_recognition"],
-                "faces_detected": 0,
-            }
-        raise RuntimeError(
-            Strings.PROCESSING_ERROR.format("emotion recognition")
-        ) from e
     except Exception as e:
         raise RuntimeError(
             Strings.PROCESSING_ERROR.format("emotion recognition")
         ) from e
+
+
+def _detect_faces(image: np.ndarray, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Face regions and classifier-ready crops; empty if no face was found"""
+    backend = config["emotion_detector_backend"]
+    started = time.perf_counter()
+    try:
+        faces = DeepFace.extract_faces(
+            img_path=image,
+            detector_backend=backend,
+            enforce_detection=config["emotion_enforce_detection"],
+            align=config.get("emotion_align", True),
+        )
+    except ValueError as e:
+        # enforce_detection raises a plain ValueError when there is no face in
+        # the photo; anything else is a real failure
+        if "Face could not be detected" not in str(e):
+            raise
+        logger.debug(f"No face found: {e}")
+        faces = []
+    metrics.FACE_DETECTION_SECONDS.observe(
+        time.perf_counter() - started, backend=backend
+    )
+    return [
+        {"region": face["facial_area"], "input": _classifier_input(face["face"])}
+        for face in faces
+    ]
+
+
+def _classifier_input(face: np.ndarray) -> np.ndarray:
+    # Same preprocessing DeepFace.analyze applies: the RGB crop back to BGR,
+    # padded to a square and resized; the client then takes it to 48x48 gray.
+    # resize_image adds a batch axis, which the client's batch input must not have
+    return resize_image(face[:, :, ::-1], FACE_INPUT_SIZE)[0]
+
+
+def _classify_batch(
+    model_data: Dict[str, Any], images: List[List[np.ndarray]]
+) -> List[List[Dict[str, float]]]:
+    """Classify every face of every image in one call, then split per image"""
+    crops = [crop for faces in images for crop in faces]
+    # The client returns a single row, not a batch of one, for one face
+    predictions = np.atleast_2d(model_data["client"].predict(crops))
+
+    scores = []
+    for prediction in predictions:
+        total = float(prediction.sum()) or 1.0
+        scores.append(
+            {
+                label: 100 * float(value) / total
+                for label, value in zip(EMOTION_LABELS, prediction)
+            }
+        )
+
+    per_image, start = [], 0
+    for faces in images:
+        per_image.append(scores[start : start + len(faces)])
+        start += len(faces)
+    return per_image
+
+
+def _scale_region(region: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    if scale == 1.0:
+        return region
+    scaled = {}
+    for key, value in region.items():
+        if isinstance(value, (int, float)):
+            scaled[key] = int(round(value / scale))
+        elif isinstance(value, (tuple, list)):
+            scaled[key] = type(value)(int(round(v / scale)) for v in value)
+        else:
+            scaled[key] = value
+    return scaled
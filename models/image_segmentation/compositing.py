@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def build_label_map(masks: List[Dict[str, Any]], shape: Tuple[int, int]) -> np.ndarray:
+    """Flatten SAM masks into a single int32 map where 0 is background.
+
+    Masks are painted largest first so small masks stay on top, and each one
+    only touches its own bounding box instead of the full image.
+    """
+    labels = np.zeros(shape, dtype=np.int32)
+    ordered = sorted(masks, key=lambda mask: mask["area"], reverse=True)
+
+    for label, mask in enumerate(ordered, start=1):
+        x, y, w, h = (int(v) for v in mask["bbox"])
+        # SAM's XYWH boxes exclude the last row/column, so widen by one pixel
+        window = (slice(y, y + h + 1), slice(x, x + w + 1))
+        labels[window][mask["segmentation"][window]] = label
+
+    return labels
+
+
+def upscale_labels(labels: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    if labels.shape == tuple(shape):
+        return labels
+    height, width = shape
+    return cv2.resize(labels, (width, height), interpolation=cv2.INTER_NEAREST)
+
+
+def make_palette(count: int, seed: int = 0) -> np.ndarray:
+    """Deterministic RGB palette with index 0 reserved for the background"""
+    palette = np.random.default_rng(seed).integers(
+        0, 256, size=(count + 1, 3), dtype=np.uint8
+    )
+    palette[0] = 0
+    return palette
+
+
+def colorize(
+    labels: np.ndarray,
+    image_rgb: np.ndarray,
+    seed: int = 0,
+    mode: str = "masks",
+    alpha: float = 0.5,
+) -> np.ndarray:
+    palette = make_palette(int(labels.max()), seed)
+    colored = palette[labels]
+
+    if mode == "overlay":
+        blended = cv2.addWeighted(image_rgb, 1 - alpha, colored, alpha, 0)
+        colored = np.where(labels[..., None] > 0, blended, image_rgb)
+
+    return colored
+
+
+def composite_masks(
+    masks: List[Dict[str, Any]],
+    image_rgb: np.ndarray,
+    config: Dict[str, Any],
+    mask_shape: Optional[Tuple[int, int]] = None,
+) -> np.ndarray:
+    """Paint masks over the photo; masks at another resolution are upscaled"""
+    shape = image_rgb.shape[:2]
+    labels = upscale_labels(build_label_map(masks, mask_shape or shape), shape)
+    return colorize(
+        labels,
+        image_rgb,
+        seed=config.get("palette_seed", 0),
+        mode=config.get("output_mode", "masks"),
+        alpha=config.get("overlay_alpha", 0.5),
+    )
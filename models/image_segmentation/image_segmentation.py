@@ -1,68 +1,218 @@
+import io
+import hashlib
 import asyncio
+import contextvars
+import logging
+import threading
 import numpy as np
 import cv2
 import torch
+from concurrent.futures import Executor
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from typing import Dict, Any, List, Optional, Tuple
+from segment_anything import (
+    sam_model_registry,
+    SamAutomaticMaskGenerator,
+    SamPredictor,
+)
 from bot.strings import Strings
+from models.backends import (
+    configure_torch_threads,
+    onnxruntime_session,
+    openvino_compile,
+    resolve_backend,
+    resolve_device,
+)
+from models.image_utils import downscale, encode_result
+from models.image_segmentation.compositing import composite_masks
 
+logger = logging.getLogger(__name__)
 
-def initialize_model(config: Dict[str, Any]) -> SamAutomaticMaskGenerator:
+
+class CachedSamPredictor(SamPredictor):
+    """SamPredictor that remembers recent image embeddings.
+
+    The ViT image encoder dominates SAM's cost, so embeddings are kept in a
+    bounded LRU keyed by image content, so the same photo segmented again
+    (another file id, or after the result cache evicted it) skips the encoder.
+    """
+
+    def __init__(self, sam_model, cache_size: int = 8):
+        super().__init__(sam_model)
+        self.cache_size = max(0, cache_size)
+        self.embeddings: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def set_image(self, image: np.ndarray, image_format: str = "RGB") -> None:
+        key = image_key(image, image_format)
+        if (cached := self.embeddings.get(key)) is not None:
+            self.embeddings.move_to_end(key)
+            self.reset_image()
+            self.features, self.original_size, self.input_size = cached
+            self.is_image_set = True
+            self.hits += 1
+            return
+
+        self.misses += 1
+        super().set_image(image, image_format)
+        if self.cache_size:
+            self.embeddings[key] = (self.features, self.original_size, self.input_size)
+            while len(self.embeddings) > self.cache_size:
+                self.embeddings.popitem(last=False)
+
+
+def image_key(image: np.ndarray, image_format: str = "RGB") -> str:
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+    digest.update(f"{image.shape}:{image_format}".encode())
+    return digest.hexdigest()
+
+
+class ExportedEncoder(torch.nn.Module):
+    """Drop-in replacement for SAM's image encoder backed by an exported graph"""
+
+    def __init__(self, run, img_size: int):
+        super().__init__()
+        self.run = run
+        self.img_size = img_size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.run(x)
+
+
+def initialize_model(config: Dict[str, Any]) -> Dict[str, Any]:
     try:
         checkpoint_path = config["checkpoint_path"]
         model_type = config["model_type"]
-        device = config.get(
-            "preferred_device", "cuda" if torch.cuda.is_available() else "cpu"
-        )
+        device = resolve_device(config.get("preferred_device"))
+        backend = resolve_backend(config, device)
+        if backend == "openvino":
+            device = "cpu"
+        threads = config.get("threads", {})
+        configure_torch_threads(threads)
 
         sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
         sam.to(device=device)
+        if backend != "torch":
+            # Only the ViT encoder is exported; the prompt encoder and mask decoder are cheap
+            sam.image_encoder = _load_encoder(
+                sam, Path(checkpoint_path), backend, threads, device
+            )
 
-        return SamAutomaticMaskGenerator(sam)
+        generator = SamAutomaticMaskGenerator(sam, **config.get("generator", {}))
+        generator.predictor = CachedSamPredictor(
+            sam, config.get("embedding_cache_size", 8)
+        )
+
+        logger.info(f"SAM {model_type} loaded with {backend} backend on {device}")
+        return {
+            "generator": generator,
+            # The generator's predictor holds per-image state, so one caller at a time
+            "lock": threading.Lock(),
+        }
     except Exception as e:
         raise RuntimeError(Strings.MODEL_INIT_ERROR.format("image segmentation")) from e
 
 
+@torch.no_grad()
+def _load_encoder(
+    sam, checkpoint_path: Path, backend: str, threads: Dict[str, Any], device: str
+) -> ExportedEncoder:
+    """Export the image encoder once, cache it next to the checkpoint and load it"""
+    img_size = sam.image_encoder.img_size
+    dummy = torch.zeros(1, 3, img_size, img_size, device=device)
+
+    if backend == "torchscript":
+        artifact = checkpoint_path.with_suffix(".encoder.torchscript")
+        if not artifact.exists():
+            logger.info(f"Tracing SAM encoder to {artifact}, this runs only once")
+            torch.jit.trace(sam.image_encoder, dummy).save(str(artifact))
+        return ExportedEncoder(
+            torch.jit.load(str(artifact), map_location=device), img_size
+        )
+
+    artifact = checkpoint_path.with_suffix(".encoder.onnx")
+    if not artifact.exists():
+        logger.info(f"Exporting SAM encoder to {artifact}, this runs only once")
+        torch.onnx.export(
+            sam.image_encoder,
+            dummy,
+            str(artifact),
+            input_names=["image"],
+            output_names=["embeddings"],
+            opset_version=17,
+        )
+
+    if backend == "onnxruntime":
+        session = onnxruntime_session(str(artifact), threads, device)
+        return ExportedEncoder(
+            lambda x: torch.from_numpy(
+                session.run(None, {"image": x.cpu().numpy()})[0]
+            ).to(x.device),
+            img_size,
+        )
+
+    compiled = openvino_compile(str(artifact), threads)
+    return ExportedEncoder(
+        lambda x: torch.from_numpy(compiled(x.cpu().numpy())[0]).to(x.device),
+        img_size,
+    )
+
+
 async def process_image(
-    original_path: str,
-    output_folder: str,
-    image_id: str,
-    mask_generator: SamAutomaticMaskGenerator,
+    image: np.ndarray,
+    model_data: Dict[str, Any],
     config: Dict[str, Any],
+    executor: Optional[Executor] = None,
 ) -> Dict[str, Any]:
     try:
-        seg_folder = Path(output_folder) / "image_segmentation"
-        seg_folder.mkdir(exist_ok=True)
-        output_path = seg_folder / f"segmentation_{image_id}.png"
-
         loop = asyncio.get_event_loop()
 
-        image_bgr = await loop.run_in_executor(None, lambda: cv2.imread(original_path))
         image_rgb = await loop.run_in_executor(
-            None, lambda: cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+            executor, lambda: cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        )
+        model_input, _ = await loop.run_in_executor(
+            executor, downscale, image_rgb, config.get("max_input_side")
         )
 
         masks = await loop.run_in_executor(
-            None, lambda: mask_generator.generate(image_rgb)
+            executor, lambda: _generate(model_data, model_input)
         )
 
-        segmentation_image = np.zeros(image_rgb.shape, dtype=np.uint8)
-        for mask in masks:
-            color = np.random.randint(0, 256, size=3)
-            segmentation_image[mask["segmentation"]] = color
-
-        await loop.run_in_executor(
-            None,
-            lambda: cv2.imwrite(
-                str(output_path), cv2.cvtColor(segmentation_image, cv2.COLOR_RGB2BGR)
-            ),
+        # In the request's context, so the encode span keeps its task and id
+        image_buffer = await loop.run_in_executor(
+            executor,
+            contextvars.copy_context().run,
+            lambda: _render(masks, model_input.shape[:2], image_rgb, config),
         )
 
         return {
-            "image_path": str(output_path),
+            "image_buffer": image_buffer,
             "model_name": Strings.MODEL_NAMES["image_segmentation"],
             "detection_summary": Strings.SEGMENTATION_SUMMARY.format(len(masks)),
         }
     except Exception as e:
         raise RuntimeError(Strings.PROCESSING_ERROR.format("image segmentation")) from e
+
+
+def _generate(
+    model_data: Dict[str, Any], image_rgb: np.ndarray
+) -> List[Dict[str, Any]]:
+    with model_data["lock"]:
+        return model_data["generator"].generate(image_rgb)
+
+
+def _render(
+    masks: list,
+    mask_shape: Tuple[int, int],
+    image_rgb: np.ndarray,
+    config: Dict[str, Any],
+) -> io.BytesIO:
+    # Masks come at model resolution; upscale the label map to the original photo
+    segmentation_image = composite_masks(masks, image_rgb, config, mask_shape)
+    return encode_result(
+        cv2.cvtColor(segmentation_image, cv2.COLOR_RGB2BGR),
+        config.get("encoding"),
+        "png",
+    )
@@ -0,0 +1,147 @@
+import io
+import time
+import logging
+import cv2
+import numpy as np
+from typing import Any, Dict, Iterator, Optional, Tuple
+from bot import metrics
+from bot.strings import Strings
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp", "sticker": ".webp"}
+# Telegram static stickers: WebP, longest side exactly 512 px
+STICKER_SIDE = 512
+STICKER_NAME = "sticker.webp"
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode raw image bytes into a BGR array shared by every model."""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(Strings.INVALID_IMAGE)
+    return image
+
+
+def encode_image(image: np.ndarray, ext: str = ".jpg", params=()) -> io.BytesIO:
+    """Encode a BGR/BGRA array into an in-memory buffer ready for upload."""
+    started = time.perf_counter()
+    success, encoded = cv2.imencode(ext, image, list(params))
+    if not success:
+        raise ValueError(Strings.INVALID_IMAGE)
+    metrics.ENCODE_SECONDS.observe(
+        time.perf_counter() - started, format=ext.lstrip(".")
+    )
+
+    buffer = io.BytesIO(encoded.tobytes())
+    buffer.name = f"result{ext}"
+    return buffer
+
+
+def encode_result(
+    image: np.ndarray,
+    encoding: Optional[Dict[str, Any]],
+    default_format: str = "jpeg",
+) -> io.BytesIO:
+    """Encode a task's result image following its ``encoding`` settings.
+
+    ``formats`` are tried in order and the first encoding within ``max_kb``
+    wins, lossy formats stepping their quality down to ``min_quality`` before
+    giving up on the format. If nothing fits, the smallest encoding is used.
+    The whole search is timed as the ``encode`` stage of the request whose
+    context the caller runs it in.
+    """
+    with metrics.span("encode"):
+        return _encode_result(image, encoding or {}, default_format)
+
+
+def _encode_result(
+    image: np.ndarray, encoding: Dict[str, Any], default_format: str
+) -> io.BytesIO:
+    budget = encoding.get("max_kb", 0) * 1024
+    candidates = (
+        buffer
+        for image_format in encoding.get("formats") or [default_format]
+        for buffer in _candidates(image, image_format, encoding)
+    )
+
+    first = best = None
+    for buffer in candidates:
+        size = buffer.getbuffer().nbytes
+        if first is None:
+            first = size
+        if not budget or size <= budget:
+            best = buffer
+            break
+        if best is None or size < best.getbuffer().nbytes:
+            best = buffer
+
+    size = best.getbuffer().nbytes
+    if first > size:
+        metrics.ENCODE_SAVED_BYTES.inc(first - size, format=best.name.split(".")[-1])
+        logger.info(
+            f"Encoded result as {best.name}: {size / 1024:.0f} KB, "
+            f"{(first - size) / 1024:.0f} KB saved"
+        )
+    return best
+
+
+def _candidates(
+    image: np.ndarray, image_format: str, encoding: Dict[str, Any]
+) -> Iterator[io.BytesIO]:
+    ext = FORMAT_EXTENSIONS[image_format]
+    if image_format == "png":
+        yield encode_image(
+            image,
+            ext,
+            (cv2.IMWRITE_PNG_COMPRESSION, encoding.get("png_compression", 3)),
+        )
+        return
+
+    if image_format == "jpeg":
+        image = _flatten_alpha(image)
+        flag, quality = cv2.IMWRITE_JPEG_QUALITY, encoding.get("jpeg_quality", 90)
+    else:
+        flag, quality = cv2.IMWRITE_WEBP_QUALITY, encoding.get("webp_quality", 90)
+    if image_format == "sticker":
+        height, width = image.shape[:2]
+        scale = STICKER_SIDE / max(height, width)
+        image = cv2.resize(
+            image,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC,
+        )
+
+    min_quality = min(quality, encoding.get("min_quality", 60))
+    while True:
+        buffer = encode_image(image, ext, (flag, quality))
+        if image_format == "sticker":
+            buffer.name = STICKER_NAME
+        yield buffer
+        if quality <= min_quality:
+            return
+        quality = max(min_quality, quality - 10)
+
+
+def _flatten_alpha(image: np.ndarray) -> np.ndarray:
+    # JPEG has no alpha channel: composite transparent areas onto white
+    if image.ndim != 3 or image.shape[2] != 4:
+        return image
+    alpha = image[..., 3:4].astype(np.float32) / 255
+    return (image[..., :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+
+
+def downscale(image: np.ndarray, max_side: Optional[int]) -> Tuple[np.ndarray, float]:
+    """Shrink an image so its longest side is at most ``max_side``.
+
+    Returns the (possibly unchanged) image and the applied scale factor, which
+    callers use to map boxes and masks back to the original resolution.
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_side or longest <= max_side:
+        return image, 1.0
+
+    scale = max_side / longest
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
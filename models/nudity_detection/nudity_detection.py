@@ -1,41 +1,64 @@
 import asyncio
-from pathlib import Path
-from typing import Dict, Any
+import contextvars
+import logging
+import cv2
+import numpy as np
+from functools import partial
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional
 from nudenet import NudeDetector
 from bot.strings import Strings
+from models.batching import MicroBatcher
+from models.image_utils import downscale, encode_result
 
+logger = logging.getLogger(__name__)
 
-def initialize_detector() -> NudeDetector:
+
+def initialize_model(config: Dict[str, Any]) -> Dict[str, Any]:
     try:
-        return NudeDetector()
+        detector = NudeDetector()
     except Exception as e:
         raise RuntimeError(Strings.MODEL_INIT_ERROR.format("nudity detection")) from e
 
+    # NudeNet releases without detect_batch run one session call per image
+    model_data = {"detector": detector, "batched": hasattr(detector, "detect_batch")}
+    batching = config.get("batching", {})
+    model_data["batcher"] = MicroBatcher(
+        partial(_detect_batch, model_data),
+        max_batch_size=batching.get("max_batch_size", 10),
+        max_wait_ms=batching.get("max_wait_ms", 20),
+        name="nudity_detection",
+        metrics_log_interval=batching.get("metrics_log_interval", 0),
+    )
+    return model_data
+
 
 async def process_image(
-    original_path: str,
-    output_folder: str,
-    image_id: str,
-    detector: NudeDetector,
+    image: np.ndarray,
+    model_data: Dict[str, Any],
     config: Dict[str, Any],
+    executor: Optional[Executor] = None,
 ) -> Dict[str, Any]:
     try:
-        detection_folder = Path(output_folder) / "nudity_detection"
-        detection_folder.mkdir(exist_ok=True)
-        censored_path = detection_folder / f"censored_{image_id}.jpg"
         nudity_classes = config["nudity_classes"]
 
         loop = asyncio.get_event_loop()
-        detections = await loop.run_in_executor(
-            None, lambda: detector.detect(original_path)
+        model_input, scale = await loop.run_in_executor(
+            executor, downscale, image, config.get("max_input_side")
+        )
+        detections = _rescale(
+            await model_data["batcher"].submit(model_input, executor), scale
         )
 
-        await loop.run_in_executor(
-            None,
-            lambda: detector.censor(
-                original_path,
-                output_path=str(censored_path),
-                classes=nudity_classes,
+        # Censor from the detections we already have instead of detector.censor,
+        # which would run the model a second time. In the request's context, so
+        # the encode span keeps its task and id
+        image_buffer = await loop.run_in_executor(
+            executor,
+            contextvars.copy_context().run,
+            lambda: encode_result(
+                _censor(image, detections, nudity_classes, config.get("censor", {})),
+                config.get("encoding"),
             ),
         )
 
@@ -49,9 +72,76 @@ async def process_image(
         )
 
         return {
-            "image_path": str(censored_path),
+            "image_buffer": image_buffer,
             "detection_summary": detection_summary,
             "model_name": Strings.MODEL_NAMES["nudity_detection"],
         }
     except Exception as e:
         raise RuntimeError(Strings.PROCESSING_ERROR.format("nudity detection")) from e
+
+
+def _detect_batch(
+    model_data: Dict[str, Any], images: List[np.ndarray]
+) -> List[List[Dict[str, Any]]]:
+    detector = model_data["detector"]
+    if model_data["batched"] and len(images) > 1:
+        try:
+            return detector.detect_batch(images, batch_size=len(images))
+        except Exception as e:
+            # ONNX graphs exported with a fixed batch size of one can't take more
+            logger.warning(f"Batched NudeNet inference failed, going per image: {e}")
+            model_data["batched"] = False
+    return [detector.detect(image) for image in images]
+
+
+def _rescale(detections: List[Dict[str, Any]], scale: float) -> List[Dict[str, Any]]:
+    if scale != 1.0:
+        for detection in detections:
+            detection["box"] = [int(round(v / scale)) for v in detection["box"]]
+    return detections
+
+
+def _censor(
+    image: np.ndarray,
+    detections: List[Dict[str, Any]],
+    classes: List[str],
+    censor_config: Dict[str, Any],
+) -> np.ndarray:
+    method = censor_config.get("method", "box")
+    height, width = image.shape[:2]
+    censored = image.copy()
+
+    for detection in detections:
+        if detection["class"] not in classes:
+            continue
+        x, y, w, h = (int(v) for v in detection["box"])
+        x1, y1 = max(x, 0), max(y, 0)
+        x2, y2 = min(x + w, width), min(y + h, height)
+        if x2 <= x1 or y2 <= y1:
+            continue
+
+        region = censored[y1:y2, x1:x2]
+        if method == "blur":
+            # Kernel relative to the region so large areas are just as unreadable
+            kernel = int(max(region.shape[:2]) * censor_config.get("blur_ratio", 0.5))
+            kernel = max(3, kernel | 1)
+            censored[y1:y2, x1:x2] = cv2.GaussianBlur(region, (kernel, kernel), 0)
+        elif method == "pixelate":
+            blocks = max(1, int(censor_config.get("pixel_blocks", 8)))
+            scale = blocks / max(region.shape[:2])
+            small = cv2.resize(
+                region,
+                (
+                    max(1, round(region.shape[1] * scale)),
+                    max(1, round(region.shape[0] * scale)),
+                ),
+                interpolation=cv2.INTER_AREA,
+            )
+            censored[y1:y2, x1:x2] = cv2.resize(
+                small,
+                (region.shape[1], region.shape[0]),
+                interpolation=cv2.INTER_NEAREST,
+            )
+        else:
+            censored[y1:y2, x1:x2] = 0
+    return censored
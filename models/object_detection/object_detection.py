@@ -1,11 +1,24 @@
-import os
-import torch
+import io
 import asyncio
+import contextvars
+import logging
+import numpy as np
+from functools import partial
 from pathlib import Path
 from collections import Counter
-from typing import Dict, Any
+from concurrent.futures import Executor
+from typing import Dict, Any, List, Optional
 from ultralytics import YOLO
 from bot.strings import Strings
+from models.backends import (
+    configure_torch_threads,
+    resolve_backend,
+    resolve_device,
+)
+from models.batching import MicroBatcher
+from models.image_utils import downscale, encode_result
+
+logger = logging.getLogger(__name__)
 
 
 def initialize_model(config: Dict[str, Any]) -> Dict[str, Any]:
@@ -15,56 +28,128 @@ def initialize_model(config: Dict[str, Any]) -> Dict[str, Any]:
         if not model_path.exists():
             raise FileNotFoundError(Strings.FILE_ERROR)
 
-        device_str = config.get(
-            "preferred_device", "cuda" if torch.cuda.is_available() else "cpu"
+        device_str = resolve_device(config.get("preferred_device"))
+        backend = resolve_backend(config, device_str)
+        if backend == "openvino":
+            device_str = "cpu"
+        half_precision = (
+            config.get("half_precision", True)
+            and device_str.startswith("cuda")
+            and backend == "torch"
         )
-        half_precision = config.get("half_precision", device_str == "cuda")
+        threads = config.get("threads") or {}
+        if backend in ("onnxruntime", "openvino") and any(threads.values()):
+            # ultralytics builds these sessions itself, without thread settings
+            raise ValueError(
+                f"threads is not supported with the {backend} backend for "
+                "object detection; leave intra_op and inter_op null"
+            )
+        configure_torch_threads(threads)
 
-        model = YOLO(model_path)
-        return {
+        model = YOLO(_export_artifact(model_path, backend), task="detect")
+        model_data = {
             "model": model,
             "device": device_str,
             "half": half_precision,
+            "backend": backend,
             "model_name": Strings.MODEL_NAMES["object_detection"],
         }
+
+        batching = config.get("batching", {})
+        model_data["batcher"] = MicroBatcher(
+            partial(_predict_batch, model_data, config),
+            max_batch_size=batching.get("max_batch_size", 16),
+            max_wait_ms=batching.get("max_wait_ms", 20),
+            name="object_detection",
+            metrics_log_interval=batching.get("metrics_log_interval", 0),
+        )
+        logger.info(f"YOLO loaded with {backend} backend on {device_str}")
+        return model_data
     except Exception as e:
         raise RuntimeError(Strings.MODEL_INIT_ERROR.format("object detection")) from e
 
 
+def _export_artifact(model_path: Path, backend: str) -> str:
+    """Export the .pt weights once and cache the artifact next to them"""
+    if backend == "torch":
+        return str(model_path)
+
+    export_format, artifact = {
+        "torchscript": ("torchscript", model_path.with_suffix(".torchscript")),
+        "onnxruntime": ("onnx", model_path.with_suffix(".onnx")),
+        "openvino": (
+            "openvino",
+            model_path.parent / f"{model_path.stem}_openvino_model",
+        ),
+    }[backend]
+
+    if not artifact.exists():
+        logger.info(f"Exporting {model_path} to {export_format}, this runs only once")
+        # Dynamic shapes keep batched inference working with the exported graph
+        artifact = Path(
+            YOLO(model_path).export(
+                format=export_format, dynamic=backend != "torchscript", half=False
+            )
+        )
+    return str(artifact)
+
+
 async def process_image(
-    original_path: str,
-    output_folder: str,
-    image_id: str,
+    image: np.ndarray,
     model_data: Dict[str, Any],
     config: Dict[str, Any],
+    executor: Optional[Executor] = None,
 ) -> Dict[str, Any]:
     try:
-        detection_folder = Path(output_folder) / "object_detection"
-        detection_folder.mkdir(exist_ok=True)
-
         loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(
-            None,
-            lambda: model_data["model"](
-                original_path,
-                conf=config["conf"],
-                iou=config["iou"],
-                augment=config["augment"],
-                device=model_data["device"],
-                half=model_data["half"],
-                save=config["save_result"],
-                project=str(output_folder),
-                name="object_detection",
-                exist_ok=True,
-            ),
+        model_input, scale = await loop.run_in_executor(
+            executor, downscale, image, config.get("max_input_side")
         )
 
-        return await _format_results(results[0], model_data)
+        result = await model_data["batcher"].submit(model_input, executor)
+
+        # In the request's context, so the encode span keeps its task and id
+        image_buffer = await loop.run_in_executor(
+            executor,
+            contextvars.copy_context().run,
+            lambda: _render(result, image, scale, config),
+        )
+
+        return await _format_results(result, image_buffer, model_data)
     except Exception as e:
         raise RuntimeError(Strings.PROCESSING_ERROR.format("object detection")) from e
 
 
-async def _format_results(result, model_data: Dict[str, Any]) -> Dict[str, Any]:
+def _predict_batch(
+    model_data: Dict[str, Any], config: Dict[str, Any], sources: List[np.ndarray]
+) -> List[Any]:
+    return model_data["model"](
+        sources,
+        conf=config["conf"],
+        iou=config["iou"],
+        augment=config["augment"],
+        device=model_data["device"],
+        half=model_data["half"],
+        verbose=False,
+    )
+
+
+def _render(
+    result, image: np.ndarray, scale: float, config: Dict[str, Any]
+) -> io.BytesIO:
+    if scale != 1.0:
+        # Map boxes back so the annotations are drawn on the full-resolution photo
+        boxes = result.boxes.data.clone()
+        boxes[:, :4] /= scale
+        result.orig_img = image
+        result.orig_shape = image.shape[:2]
+        result.update(boxes=boxes)
+    return encode_result(result.plot(), config.get("encoding"))
+
+
+async def _format_results(
+    result, image_buffer: io.BytesIO, model_data: Dict[str, Any]
+) -> Dict[str, Any]:
     try:
         class_counts = Counter(result.names[int(cls)] for cls in result.boxes.cls)
         detection_lines = [
@@ -82,12 +167,8 @@ async def _format_results(result, model_data: Dict[str, Any]) -> Dict[str, Any]:
             postprocess=speed["postprocess"],
         )
 
-        processed_path = Path(result.save_dir) / Path(result.path).name
-        if not processed_path.exists():
-            raise FileNotFoundError(Strings.FILE_ERROR)
-
         return {
-            "image_path": str(processed_path),
+            "image_buffer": image_buffer,
             "detection_summary": detection_summary,
             "speed_summary": speed_summary,
             "model_name": model_data["model_name"],
@@ -0,0 +1,244 @@
+import gc
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import importlib
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+from types import ModuleType
+from bot import metrics, startup
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_mb() -> float:
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def import_task_module(task: str) -> ModuleType:
+    """A task's pipeline module, imported on first use.
+
+    The pipelines pull in torch, ultralytics, TensorFlow and friends, so they
+    are only imported once a task is actually needed. Blocking: call it from
+    an executor when on the event loop.
+    """
+    name = f"models.{task}.{task}"
+    if module := sys.modules.get(name):
+        return module
+    with startup.timed(f"import {name}"):
+        return importlib.import_module(name)
+
+
+class _Entry:
+    def __init__(self, loader: Callable[[], Any], unloader: Optional[Callable]):
+        self.loader = loader
+        self.unloader = unloader
+        self.model: Any = None
+        self.loaded = False
+        self.in_use = 0
+        self.last_used = 0.0
+        self.lock = asyncio.Lock()
+
+
+class ModelRegistry:
+    """Loads models on first use and unloads them again when idle.
+
+    Each model has its own lock so concurrent first requests share one load,
+    and models in use are never evicted.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        registry_config = config.get("registry", {})
+        self.warm_up_models: List[str] = registry_config.get("warm_up", [])
+        self.idle_ttl = registry_config.get("idle_ttl_seconds", 0)
+        self.memory_budget_mb = registry_config.get("memory_budget_mb", 0)
+        self.check_interval = registry_config.get("check_interval_seconds", 60)
+
+        self._entries: Dict[str, _Entry] = {}
+        self._evictor: Optional[asyncio.Task] = None
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        unloader: Optional[Callable[[Any], Any]] = None,
+    ):
+        self._entries[name] = _Entry(loader, unloader)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._entries and self._entries[name].loaded
+
+    async def load(self, name: str) -> Any:
+        entry = self._entries[name]
+        async with entry.lock:
+            if not entry.loaded:
+                started = time.perf_counter()
+                loop = asyncio.get_event_loop()
+                entry.model = await loop.run_in_executor(None, entry.loader)
+                entry.loaded = True
+                elapsed = time.perf_counter() - started
+                metrics.MODEL_LOAD_SECONDS.observe(elapsed, model=name)
+                startup.record(f"load {name} (incl. import)", elapsed)
+                metrics.MODEL_LOADED.set(1, model=name)
+                logger.info(
+                    f"Loaded {name} in {elapsed:.1f}s "
+                    f"(RSS {current_rss_mb():.0f} MB)"
+                )
+            entry.last_used = time.monotonic()
+            return entry.model
+
+    async def unload(self, name: str):
+        entry = self._entries[name]
+        async with entry.lock:
+            if not entry.loaded or entry.in_use:
+                return
+            model, entry.model, entry.loaded = entry.model, None, False
+            if entry.unloader is not None:
+                result = entry.unloader(model)
+                if inspect.isawaitable(result):
+                    await result
+            del model
+        metrics.MODEL_LOADED.set(0, model=name)
+        _release_memory()
+        logger.info(f"Unloaded {name} (RSS {current_rss_mb():.0f} MB)")
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        entry = self._entries[name]
+        entry.in_use += 1
+        try:
+            yield await self.load(name)
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    async def warm_up(self):
+        """Load the warm-up models concurrently, each on its own executor thread.
+
+        Requests that need one of them meanwhile wait on its load instead of
+        failing.
+        """
+        names = []
+        for name in self.warm_up_models:
+            if name in self._entries:
+                names.append(name)
+            else:
+                logger.warning(f"Unknown model in registry warm-up list: {name}")
+
+        results = await asyncio.gather(
+            *(self.load(name) for name in names), return_exceptions=True
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                # Not fatal: the next request for it retries the load
+                logger.error(f"Warm-up of {name} failed: {result}")
+
+    def start(self):
+        if (self.idle_ttl or self.memory_budget_mb) and self._evictor is None:
+            self._evictor = asyncio.get_event_loop().create_task(self._evict_loop())
+
+    async def close(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+            try:
+                await self._evictor
+            except asyncio.CancelledError:
+                pass
+            self._evictor = None
+        for name in self._entries:
+            await self.unload(name)
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self._evict()
+            except Exception as e:
+                logger.error(f"Model eviction failed: {e}")
+
+    async def _evict(self):
+        now = time.monotonic()
+        idle = sorted(
+            (entry.last_used, name)
+            for name, entry in self._entries.items()
+            if entry.loaded and not entry.in_use
+        )
+
+        for last_used, name in list(idle):
+            if self.idle_ttl and now - last_used > self.idle_ttl:
+                logger.info(f"Evicting {name}: idle for {now - last_used:.0f}s")
+                await self.unload(name)
+                idle.remove((last_used, name))
+
+        # Over budget: drop least recently used idle models until we fit
+        while (
+            self.memory_budget_mb and idle and current_rss_mb() > self.memory_budget_mb
+        ):
+            _, name = idle.pop(0)
+            logger.info(f"Evicting {name}: over {self.memory_budget_mb} MB budget")
+            await self.unload(name)
+
+
+def _release_memory():
+    gc.collect()
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def build_registry(config: Dict[str, Any]) -> ModelRegistry:
+    """Registry with a loader for every task that owns a model.
+
+    Loaders import their pipeline module themselves, so building the registry
+    stays cheap and each heavy import happens on the loader's thread.
+    """
+    models_config = config["models"]
+    registry = ModelRegistry(config)
+    registry.register(
+        "object_detection",
+        lambda: import_task_module("object_detection").initialize_model(
+            models_config["object_detection"]
+        ),
+        unloader=lambda model_data: model_data["batcher"].close(),
+    )
+    registry.register(
+        "nudity_detection",
+        lambda: import_task_module("nudity_detection").initialize_model(
+            models_config["nudity_detection"]
+        ),
+        unloader=lambda model_data: model_data["batcher"].close(),
+    )
+    registry.register(
+        "image_segmentation",
+        lambda: import_task_module("image_segmentation").initialize_model(
+            models_config["image_segmentation"]
+        ),
+    )
+    registry.register(
+        "background_removal",
+        lambda: import_task_module("background_removal").initialize_model(
+            models_config["background_removal"]
+        ),
+    )
+    registry.register(
+        "emotion_recognition",
+        lambda: import_task_module("emotion_recognition").initialize_model(
+            models_config["emotion_recognition"]
+        ),
+        unloader=lambda model_data: model_data["batcher"].close(),
+    )
+    return registry
@@ -1,39 +1,208 @@
+import os
 import asyncio
-from pathlib import Path
-from PIL import Image
+import cv2
+import numpy as np
 import pytesseract
-from typing import Dict, Any
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from bot.strings import Strings
+from models.image_utils import downscale
+
+PREPROCESS_STEPS = ("grayscale", "binarize", "deskew")
 
 
 async def process_image(
-    original_path: str, output_folder: str, image_id: str
+    image: np.ndarray,
+    config: Dict[str, Any],
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[str], Awaitable[None]]] = None,
 ) -> Dict[str, Any]:
-    try:
-        text_folder = Path(output_folder) / "text_extraction"
-        text_folder.mkdir(exist_ok=True)
+    """OCR the image strip by strip, in parallel on ``executor``.
 
+    At most as many strips as the executor has workers are submitted at once,
+    so one tall page can't fill the pool's queue ahead of other requests.
+    ``progress`` is awaited with the text recognised so far, in reading order,
+    each time another leading strip completes.
+    """
+    try:
         loop = asyncio.get_event_loop()
-        text = await loop.run_in_executor(None, lambda: _extract_text(original_path))
+        # Module-level functions and plain arguments so this also works in a process pool
+        image = await loop.run_in_executor(
+            executor,
+            _prepare,
+            image,
+            config.get("max_input_side"),
+            config.get("preprocess", ["grayscale"]),
+        )
 
-        txt_path = text_folder / f"extracted_{image_id}.txt"
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(text or Strings.NO_TEXT)
+        spans = _tile_spans(
+            image, config.get("tile_height", 0), config.get("tile_overlap", 0)
+        )
+        tesseract_config = f"--psm {config.get('psm', 3)} --oem {config.get('oem', 3)}"
+        limit = asyncio.Semaphore(_max_workers(executor))
+        # Started in reading order, so the semaphore also frees strips in that order
+        futures = [
+            asyncio.ensure_future(
+                _read_strip(
+                    index,
+                    image[top:bottom],
+                    limit,
+                    executor,
+                    config.get("lang", "eng"),
+                    tesseract_config,
+                )
+            )
+            for index, (top, bottom, _) in enumerate(spans)
+        ]
+
+        chunks: List[Optional[str]] = [None] * len(futures)
+        emitted = 0
+        try:
+            for next_done in asyncio.as_completed(futures):
+                index, text = await next_done
+                chunks[index] = text
+                # Only stream once the text before this strip is known too
+                if progress and index == emitted:
+                    while emitted < len(chunks) and chunks[emitted] is not None:
+                        emitted += 1
+                    if emitted < len(chunks):
+                        await progress(_merge(chunks[:emitted], spans))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
         return {
-            "text": text,
-            "text_path": str(txt_path),
+            "text": _merge(chunks, spans),
             "model_name": Strings.MODEL_NAMES["text_extraction"],
         }
     except Exception as e:
         raise RuntimeError(Strings.PROCESSING_ERROR.format("text extraction")) from e
 
 
-def _extract_text(image_path: str) -> str:
+async def _read_strip(
+    index: int,
+    strip: np.ndarray,
+    limit: asyncio.Semaphore,
+    executor: Optional[Executor],
+    lang: str,
+    tesseract_config: str,
+) -> Tuple[int, str]:
+    async with limit:
+        loop = asyncio.get_event_loop()
+        text = await loop.run_in_executor(
+            executor, _extract_text, strip, lang, tesseract_config
+        )
+    return index, text
+
+
+def _max_workers(executor: Optional[Executor]) -> int:
+    # Both standard executors record their size; the loop's default one is None
+    return getattr(executor, "_max_workers", None) or os.cpu_count() or 1
+
+
+def _prepare(
+    image: np.ndarray, max_input_side: Optional[int], steps: List[str]
+) -> np.ndarray:
+    if unknown := set(steps) - set(PREPROCESS_STEPS):
+        raise ValueError(f"Unknown OCR preprocessing steps: {', '.join(unknown)}")
+
+    image, _ = downscale(image, max_input_side)
+    if not steps:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # Every step works on a single channel, so grayscale is implied
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    for step in steps:
+        if step == "binarize":
+            _, image = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        elif step == "deskew":
+            image = _deskew(image)
+    return image
+
+
+def _deskew(gray: np.ndarray, max_angle: float = 15.0) -> np.ndarray:
+    """Rotate so text lines run horizontally, judging the angle from the ink"""
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Smear characters into line-shaped blobs so the fitted rectangle follows the lines
+    ink = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 3)))
+    coords = cv2.findNonZero(ink)
+    if coords is None:
+        return gray
+
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV versions disagree on the range; fold it into (-45, 45]
+    while angle > 45:
+        angle -= 90
+    while angle <= -45:
+        angle += 90
+    if abs(angle) < 0.5 or abs(angle) > max_angle:
+        return gray
+
+    height, width = gray.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(
+        gray,
+        matrix,
+        (width, height),
+        flags=cv2.INTER_CUBIC,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def _tile_spans(
+    image: np.ndarray, tile_height: int, overlap: int
+) -> List[Tuple[int, int, bool]]:
+    """Split the image into horizontal strips of roughly ``tile_height`` rows.
+
+    Each cut is moved to the emptiest row near the target so it falls between
+    lines of text. Strips that could not be cut on a blank row overlap the next
+    one by ``overlap`` rows; the third item of each span records that.
+    """
+    height = image.shape[0]
+    if not tile_height or height <= tile_height * 1.5:
+        return [(0, height, False)]
+
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    # Ink per row: dark pixels relative to the page background
+    ink = (gray < np.median(gray) - 40).sum(axis=1)
+    window = max(1, tile_height // 4)
+
+    spans = []
+    top = 0
+    while height - top > tile_height * 1.5:
+        target = top + tile_height
+        low, high = target - window, min(height, target + window)
+        band = ink[low:high]
+        # Of the emptiest rows, take the one closest to the target height
+        candidates = low + np.flatnonzero(band == band.min())
+        cut = int(candidates[np.argmin(np.abs(candidates - target))])
+        clean = ink[cut] == 0
+        bottom = cut if clean else min(height, cut + overlap)
+        spans.append((top, bottom, not clean))
+        top = cut
+    spans.append((top, height, False))
+    return spans
+
+
+def _merge(chunks: List[str], spans: List[Tuple[int, int, bool]]) -> str:
+    lines: List[str] = []
+    for text, (_, _, overlapped_prev) in zip(chunks, [(0, 0, False)] + spans):
+        new_lines = text.strip("\n").splitlines()
+        if overlapped_prev:
+            # The overlap band was read twice; drop the repeated leading lines
+            for n in range(min(len(lines), len(new_lines)), 0, -1):
+                if lines[-n:] == new_lines[:n]:
+                    new_lines = new_lines[n:]
+                    break
+        lines.extend(new_lines)
+    return "\n".join(lines).strip()
+
+
+def _extract_text(
+    image: np.ndarray, lang: str = "eng", tesseract_config: str = ""
+) -> str:
     try:
-        with Image.open(image_path) as img:
-            return pytesseract.image_to_string(img)
-    except IOError:
-        raise ValueError(Strings.INVALID_IMAGE)
+        return pytesseract.image_to_string(image, lang=lang, config=tesseract_config)
     except pytesseract.TesseractNotFoundError:
         raise RuntimeError(Strings.MISSING_DEPENDENCY.format("Tesseract OCR"))
@@ -0,0 +1,37 @@
+import pytest
+
+rembg_sessions = pytest.importorskip("rembg.sessions")
+
+from rembg.sessions import base  # noqa: E402
+from rembg.sessions.u2net import U2netSession  # noqa: E402
+from models.background_removal import background_removal  # noqa: E402
+
+
+@pytest.fixture
+def inference_sessions(monkeypatch):
+    """Record the ONNX sessions rembg would open, without downloading the model"""
+    opened = []
+    monkeypatch.setattr(
+        U2netSession, "download_models", classmethod(lambda cls, *a, **k: "u2net.onnx")
+    )
+    monkeypatch.setattr(
+        base.ort,
+        "InferenceSession",
+        lambda path, sess_options=None, providers=None: opened.append(sess_options),
+    )
+    return opened
+
+
+def test_new_session_applies_onnx_threads(inference_sessions):
+    session = background_removal._new_session("u2net", 3)
+
+    assert isinstance(session, U2netSession)
+    assert inference_sessions[0].intra_op_num_threads == 3
+    assert inference_sessions[0].inter_op_num_threads == 3
+
+
+def test_new_session_keeps_library_defaults(inference_sessions):
+    background_removal._new_session("u2net", None)
+
+    assert inference_sessions[0].intra_op_num_threads == 0
+    assert inference_sessions[0].inter_op_num_threads == 0
@@ -0,0 +1,31 @@
+import asyncio
+from bot import tasks
+from bot.scheduler import Scheduler
+from models.batching import MicroBatcher
+
+
+def test_burst_larger_than_max_workers_forms_one_batch(monkeypatch):
+    scheduler = Scheduler(
+        {"scheduler": {"default": {"max_workers": 2, "queue_size": 16}}}
+    )
+    batcher = MicroBatcher(lambda items: items, max_batch_size=16, max_wait_ms=50)
+
+    async def run_task(task, image, resources, executor=None, progress=None):
+        return await batcher.submit(image, executor)
+
+    monkeypatch.setattr(tasks, "run_task", run_task)
+
+    async def burst():
+        try:
+            return await asyncio.gather(
+                *(
+                    tasks.run_on_pool("object_detection", i, {"scheduler": scheduler})
+                    for i in range(10)
+                )
+            )
+        finally:
+            await batcher.close()
+
+    assert asyncio.run(burst()) == list(range(10))
+    assert batcher.stats()["batch_sizes"] == {10: 1}
+    scheduler.shutdown()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("deepface")
+
+from deepface.models.demography.onnx.Emotion import EmotionClient  # noqa: E402
+from models.emotion_recognition import emotion_recognition  # noqa: E402
+
+
+class RecordingSession:
+    """Stands in for the ONNX graph, so only DeepFace's own preprocessing runs"""
+
+    def __init__(self):
+        self.inputs = []
+
+    def get_inputs(self):
+        return [type("Input", (), {"name": "input"})]
+
+    def run(self, outputs, feed):
+        batch = feed["input"]
+        self.inputs.append(batch.shape)
+        scores = np.full((len(batch), 7), 0.02, dtype=np.float32)
+        scores[:, 3] = 0.88
+        return [scores]
+
+
+@pytest.fixture
+def client():
+    client = EmotionClient.__new__(EmotionClient)
+    client.model_name = "Emotion"
+    client.model = RecordingSession()
+    return client
+
+
+def _face(height, width):
+    rng = np.random.default_rng(height * width)
+    return rng.random((height, width, 3), dtype=np.float32)
+
+
+def test_faces_of_several_photos_share_one_client_call(client):
+    images = [
+        [emotion_recognition._classifier_input(_face(80, 60))] * 2,
+        [emotion_recognition._classifier_input(_face(50, 70))],
+    ]
+
+    scores = emotion_recognition._classify_batch({"client": client}, images)
+
+    assert client.model.inputs == [(3, 48, 48, 1)]
+    assert [len(faces) for faces in scores] == [2, 1]
+    assert max(scores[1][0], key=scores[1][0].get) == "happy"
+
+
+def test_single_face(client):
+    images = [[emotion_recognition._classifier_input(_face(64, 64))]]
+
+    scores = emotion_recognition._classify_batch({"client": client}, images)
+
+    assert client.model.inputs == [(1, 48, 48, 1)]
+    assert round(sum(scores[0][0].values())) == 100
@@ -0,0 +1,249 @@
+"""Local stand-in for the Telegram Bot API, for testing webhook mode offline.
+
+It answers the Bot API methods the bot uses, records every call, and once the
+bot registers its webhook it posts a scripted conversation to it: /start,
+a task selection and a photo. Point the bot at it with
+
+    app:
+      mode: "webhook"
+      bot_api_base_url: "http://127.0.0.1:8081/bot"
+      bot_api_base_file_url: "http://127.0.0.1:8081/file/bot"
+      webhook:
+        listen: "127.0.0.1"
+        port: 8443
+        webhook_url: "http://127.0.0.1:8443/snapsense"
+
+and run ``python -m tools.fake_telegram --task text_extraction`` before main.py.
+"""
+
+import json
+import time
+import base64
+import argparse
+import threading
+import itertools
+import urllib.request
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+SAMPLE_PHOTO = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAA0JCgsKCA0LCgsODg0PEyAVExISEyccHhcgLikxMC4p"
+    "LSwzOko+MzZGNywtQFdBRkxOUlNSMj5aYVpQYEpRUk//2wBDAQ4ODhMREyYVFSZPNS01T09PT09P"
+    "T09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT0//wAARCABAAEADASIA"
+    "AhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQA"
+    "AAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3"
+    "ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWm"
+    "p6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEA"
+    "AwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSEx"
+    "BhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElK"
+    "U1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3"
+    "uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDrKKKK"
+    "ACiiigAooooAKKKKACuX1/xiui6r9hNiZvlVi/m7evtg11FeWfEHjxQx/wCmSUAep1y48YqfEv8A"
+    "Y/2E/wCv8nzfN7+uMf1p3/Cd6F/z0n/79GuMsbmO88fRXUBJjlvN65GDgmgDsPFPiDVtJ1GKDTrF"
+    "J4niDlmiduckY4I9B+ddPGxaJGYbWIBI9K4zxt4i1PSNUggsJljjaEOwKBsncR3+ldnGxaJGPUqD"
+    "QA6iiigAryz4g8+KGH/TJK9TrlvEHg4a1qv277eYflVSnlbunvkUAS/8INoP/PvL/wB/WrirK2is"
+    "/H8VtACIorzYoJzgA16zXLDwcB4l/tj7ecef53leV+ON2f6UAc78S/8AkO23/XsP/Qmr0iD/AFEf"
+    "+6P5VzviXwmNfvorn7d9n8uPy9vlb88k56j1rpEXYiqP4RigBaKKKACiiigAooooAKKKKACiiigD"
+    "/9k="
+)
+
+CHAT = {"id": 4242, "type": "private", "first_name": "Tester"}
+USER = {"id": 4242, "is_bot": False, "first_name": "Tester"}
+BOT = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "SnapSense",
+    "username": "SnapSenseBot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeTelegram:
+    def __init__(self, task: str, photo: bytes):
+        self.task = task
+        self.photo = photo
+        self.calls = []
+        self.webhook_url = None
+        self.secret_token = None
+        self._message_ids = itertools.count(100)
+        self._update_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def message(self, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": CHAT,
+            "from": BOT,
+            **fields,
+        }
+
+    def photo_sizes(self, file_id: str) -> list:
+        return [
+            {
+                "file_id": file_id,
+                "file_unique_id": f"u-{file_id}",
+                "width": 64,
+                "height": 64,
+                "file_size": len(self.photo),
+            }
+        ]
+
+    def call(self, method: str, params: dict):
+        with self._lock:
+            self.calls.append((method, params))
+        print(f"[fake-telegram] {method} {json.dumps(params, default=str)[:200]}")
+
+        if method == "getMe":
+            return BOT
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            self.secret_token = params.get("secret_token")
+            threading.Thread(target=self.run_scenario, daemon=True).start()
+            return True
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self.message(text=params.get("text", ""))
+        if method == "sendPhoto":
+            return self.message(
+                photo=self.photo_sizes(f"result-{next(self._message_ids)}"),
+                caption=params.get("caption"),
+            )
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media", "[]"))
+            return [
+                self.message(
+                    photo=self.photo_sizes(f"result-{next(self._message_ids)}")
+                )
+                for _ in media
+            ]
+        if method == "getFile":
+            return {
+                "file_id": params.get("file_id"),
+                "file_unique_id": f"u-{params.get('file_id')}",
+                "file_size": len(self.photo),
+                "file_path": "photos/sample.jpg",
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+    def post_update(self, update: dict):
+        update = {"update_id": next(self._update_ids), **update}
+        request = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(update).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        if self.secret_token:
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", self.secret_token)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            print(f"[fake-telegram] update {update['update_id']} -> {response.status}")
+
+    def run_scenario(self):
+        time.sleep(1)
+        self.post_update(
+            {
+                "message": self.message(
+                    **{"from": USER},
+                    text="/start",
+                    entities=[{"type": "bot_command", "offset": 0, "length": 6}],
+                )
+            }
+        )
+        time.sleep(1)
+        self.post_update(
+            {
+                "callback_query": {
+                    "id": "callback-1",
+                    "from": USER,
+                    "chat_instance": "fake-chat",
+                    "data": self.task,
+                    "message": self.message(text="menu"),
+                }
+            }
+        )
+        time.sleep(1)
+        self.post_update(
+            {
+                "message": self.message(
+                    **{"from": USER}, photo=self.photo_sizes("upload")
+                )
+            }
+        )
+
+
+def make_handler(fake: FakeTelegram):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if "/file/" not in self.path:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(fake.photo)))
+            self.end_headers()
+            self.wfile.write(fake.photo)
+
+        def do_POST(self):
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            result = fake.call(method, self._params(body))
+            payload = json.dumps({"ok": True, "result": result}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _params(self, body: bytes) -> dict:
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("application/json"):
+                return json.loads(body or b"{}")
+            if content_type.startswith("multipart/form-data"):
+                message = BytesParser(policy=default_policy).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode() + body
+                )
+                return {
+                    part.get_param("name", header="content-disposition"): (
+                        part.get_content()
+                        if part.get_filename() is None
+                        else f"<file {part.get_filename()}>"
+                    )
+                    for part in message.iter_parts()
+                }
+            return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--task", default="text_extraction")
+    parser.add_argument("--photo", help="JPEG to serve instead of the built-in sample")
+    args = parser.parse_args()
+
+    photo = SAMPLE_PHOTO
+    if args.photo:
+        with open(args.photo, "rb") as f:
+            photo = f.read()
+
+    fake = FakeTelegram(args.task, photo)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"[fake-telegram] listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
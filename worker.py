@@ -0,0 +1,155 @@
+"""Inference worker: serves jobs from the shared queue configured under ``jobs``.
+
+    python worker.py --tasks object_detection,image_segmentation
+
+Run as many workers as needed, on as many hosts as can reach the queue; each
+one only loads the models for the tasks it serves.
+"""
+
+import uuid
+import socket
+import asyncio
+import logging
+import argparse
+import yaml
+from bot import metrics, startup
+from bot.jobs import create_backend
+from bot.scheduler import BATCHED_TASKS, TASKS, Scheduler
+from bot.tasks import run_on_pool
+from models import image_utils
+from models.registry import build_registry
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# First and longest wait, in seconds, before claiming again after a queue error
+RETRY_SECONDS = (1, 30)
+
+
+def load_config(config_path="config.yaml"):
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    return config
+
+
+async def heartbeat(jobs, worker_id: str, tasks, interval: float):
+    while True:
+        try:
+            await jobs.advertise(worker_id, tasks)
+        except Exception as e:
+            logger.error(f"Worker heartbeat failed: {e}")
+        await asyncio.sleep(interval)
+
+
+async def serve(jobs, worker_id: str, task: str, resources):
+    loop = asyncio.get_event_loop()
+    delay = RETRY_SECONDS[0]
+    while True:
+        try:
+            job = await jobs.claim([task], worker_id)
+        except Exception as e:
+            # A queue outage (Redis unreachable, SQLite locked) must not end the
+            # worker: back off and try again
+            logger.error(f"Claiming {task} jobs failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_SECONDS[1])
+            continue
+        delay = RETRY_SECONDS[0]
+
+        metrics.REQUEST_ID.set(job["id"])
+        try:
+            with metrics.span("decode", task):
+                image = await loop.run_in_executor(
+                    None, image_utils.decode_image, job["image_bytes"]
+                )
+            result = await run_on_pool(task, image, resources)
+            await jobs.complete(job["id"], result)
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({task}) failed: {e}")
+            try:
+                await jobs.fail(job["id"], str(e) or f"{task} failed")
+            except Exception as e:
+                # The front-end times the job out instead
+                logger.error(f"Could not report job {job['id']} as failed: {e}")
+
+
+def claim_loops(config, task: str, scheduler: Scheduler) -> int:
+    """How many jobs of a task this worker holds at once.
+
+    Batched tasks claim a full batch, since one batch occupies a single slot.
+    """
+    max_workers = scheduler.pool(task).max_workers
+    if task not in BATCHED_TASKS:
+        return max_workers
+    batching = config["models"][task].get("batching", {})
+    return max(max_workers, batching.get("max_batch_size", 8))
+
+
+async def run(config, tasks, metrics_port=None):
+    jobs_config = config.get("jobs", {})
+    metrics.configure(config)
+    if metrics_port:
+        metrics.start_server(
+            config.get("metrics", {}).get("host", "127.0.0.1"), metrics_port
+        )
+    resources = {
+        "config": config,
+        "scheduler": Scheduler(config),
+        "model_registry": build_registry(config),
+    }
+    jobs = create_backend(config, resources)
+    if jobs.local:
+        raise ValueError("Workers need a shared job queue: set jobs.backend")
+
+    worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+    registry = resources["model_registry"]
+    registry.warm_up_models = [m for m in registry.warm_up_models if m in tasks]
+    await registry.warm_up()
+    registry.start()
+    startup.finish()
+
+    # One claim loop per job the pool can take keeps every worker thread busy
+    loops = [
+        serve(jobs, worker_id, task, resources)
+        for task in tasks
+        for _ in range(claim_loops(config, task, resources["scheduler"]))
+    ]
+    logger.info(f"Worker {worker_id} serving {', '.join(tasks)}")
+    try:
+        await asyncio.gather(
+            heartbeat(jobs, worker_id, tasks, jobs_config.get("heartbeat_seconds", 10)),
+            *loops,
+        )
+    finally:
+        await registry.close()
+        resources["scheduler"].shutdown()
+        await jobs.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tasks",
+        default=",".join(TASKS),
+        help="comma-separated tasks to serve (default: all)",
+    )
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve /metrics on this port (default: off)"
+    )
+    args = parser.parse_args()
+
+    tasks = [task.strip() for task in args.tasks.split(",") if task.strip()]
+    if unknown := set(tasks) - set(TASKS):
+        parser.error(f"unknown tasks: {', '.join(sorted(unknown))}")
+
+    try:
+        asyncio.run(run(load_config(args.config), tasks, args.metrics_port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()